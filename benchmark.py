@@ -0,0 +1,143 @@
+import time
+import os
+import sys
+import subprocess
+import tempfile
+from dartboard import Dartboard
+from gaussian import Gaussian, STENCIL
+
+
+"""Timings for the parts of the search that are run many times, and for 
+   starting up a worker, with a check that the batched stencil agrees with
+   the FFT map. Run with
+   python benchmark.py
+"""
+
+# Cold start budgets in seconds: importing main, and importing main then 
+# loading a board
+IMPORT_BUDGET = 0.5
+STARTUP_BUDGET = 0.6
+
+# Run in a fresh interpreter so no modules are already imported
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+db = main.GenerateDartboard().load(sys.argv[1])
+db.board_mask
+loaded = time.perf_counter()
+print(imported - start, loaded - start, 'matplotlib' in sys.modules)
+"""
+
+
+def timeit(function, repeats=5):
+    """Returns the best time in seconds of calling function repeats times.
+
+    Args:
+        function (function): the function to time, takes no arguments.
+        repeats (int, optional): number of times to call it. Defaults to 5.
+
+    Returns:
+        float: the fastest time taken.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmarkMasks():
+    """Times building the board mask and the circular kernel mask."""
+    print("Board mask (Dartboard.calcCircularMask)")
+    for size in (1200, 5000):
+        db = Dartboard((size, size))
+        t = timeit(lambda: db.calcCircularMask(radius=size * 0.38))
+        print(f"  {size}x{size}: {t * 1000:.1f}ms")
+    
+    print("Kernel mask (Gaussian.calcCircularMask)")
+    gaussian = Gaussian()
+    for size in (297, 1200, 5000):
+        t = timeit(lambda: gaussian.calcCircularMask(size))
+        print(f"  {size}x{size}: {t * 1000:.1f}ms")
+
+
+def checkStencilEdges(kernel_sizes=(51, 100, 297, 401), tolerance=1e-9):
+    """Checks the batched stencil gives the same expected values as the FFT 
+       map, at points near the edge of the board array where the kernel runs
+       off it (odd and even kernel sizes start their windows differently).
+
+    Args:
+        kernel_sizes (iterable of int, optional): kernel sizes to check.
+                                                  Defaults to (51, 100, 297, 401).
+        tolerance (float, optional): largest difference allowed. Defaults to 
+                                     1e-9.
+
+    Returns:
+        bool: True if every value matches.
+    """
+    from generate_polar_dartboard import GeneratePolarDartboard
+    
+    print("Stencil against FFT map near the edge of the board array")
+    dartboard = GeneratePolarDartboard().generate().board
+    height, width = dartboard.shape
+    gaussian = Gaussian()
+    matches = True
+    for size in kernel_sizes:
+        gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=size)
+        expected_values = gaussian.calcExpectedValues(dartboard)
+        worst = 0
+        for point in ((1, 1), (size // 2, width // 2), (height // 2, size // 2 + 1), 
+                      (height - 2, width - 2), (height // 6, width // 2)):
+            values = gaussian.applyGaussianStencil(dartboard, point, d=1)
+            for (dy, dx), value in zip(STENCIL, values):
+                worst = max(worst, abs(value - expected_values[point[0] + dy, point[1] + dx]))
+        matches = matches and worst <= tolerance
+        print(f"  {size}x{size}: largest difference {worst:.2e}")
+    print("  match" if matches else "  MISMATCH")
+    return matches
+
+
+def benchmarkStartup(repeats=5):
+    """Times the cold start of a headless worker, importing main and loading a
+       board file, each in a fresh interpreter, and checks the best times are
+       within the budgets.
+
+    Args:
+        repeats (int, optional): number of fresh interpreters to time. 
+                                 Defaults to 5.
+
+    Returns:
+        bool: True if within the budgets.
+    """
+    from generate_polar_dartboard import GeneratePolarDartboard
+    
+    print("Cold start (import main, load a board file)")
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'dartboard.board')
+        GeneratePolarDartboard().generate().save(filename)
+        
+        import_time, startup_time = float('inf'), float('inf')
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, filename], capture_output=True, 
+                                    text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+            import_time = min(import_time, float(output[0]))
+            startup_time = min(startup_time, float(output[1]))
+            plotting = output[2] == 'True'
+    
+    within = import_time <= IMPORT_BUDGET and startup_time <= STARTUP_BUDGET and not plotting
+    print(f"  import: {import_time * 1000:.1f}ms (budget {IMPORT_BUDGET * 1000:.0f}ms)")
+    print(f"  import and load: {startup_time * 1000:.1f}ms (budget {STARTUP_BUDGET * 1000:.0f}ms)")
+    if plotting:
+        print("  matplotlib was imported")
+    print("  within budget" if within else "  OVER BUDGET")
+    return within
+
+
+if __name__ == "__main__":
+    benchmarkMasks()
+    matches = checkStencilEdges()
+    if not benchmarkStartup() or not matches:
+        sys.exit(1)
@@ -0,0 +1,220 @@
+from dartboard import Dartboard
+from gaussian import Gaussian
+from hit_probabilities import HitProbabilities
+import numpy as np
+
+
+"""Finds where to aim to finish a leg of 501, where the last dart must hit a
+   double (or the bull) to reach exactly zero. Throws land around the aim point
+   following a Gaussian kernel, as in GradientDescent.run. Hit probabilities
+   are found for a candidate set of aim points, then the value of every score
+   is found by dynamic programming from 2 upwards, with two objectives:
+   the probability of finishing within the darts left in the visit, and the
+   expected number of darts needed to finish.
+   A dart that leaves a score below 2, or zero without a double, is a bust: the
+   visit ends and the score goes back to what it was at the start of the visit.
+   Regions that score the same and are either both doubles or both not doubles
+   lead to the same states, so they are grouped into outcomes.
+"""
+class Checkout():
+    def __init__(self, dartboard, kernel_size, sigma=0.3, stride=4, per_region=4, max_score=501):
+        """
+        Args:
+            dartboard (Dartboard): the dartboard, with a region map.
+            kernel_size (float): size of the Gaussian kernel describing the
+                                 accuracy of the throws.
+            sigma (float, optional): the standard deviation of the Gaussian
+                                     distribution. Defaults to 0.3.
+            stride (int, optional): spacing in pixels of the aim points that
+                                    hit probabilities are calculated for.
+                                    Defaults to 4.
+            per_region (int, optional): number of aim points kept as candidates
+                                        for each region, the points most likely
+                                        to hit the region. Defaults to 4.
+            max_score (int, optional): highest score to solve. Defaults to 501.
+        """
+        self.max_score = max_score
+
+        gaussian = Gaussian()
+        gaussian.calcCircularGaussianSize(kernel_size, sigma=sigma)
+        probabilities = HitProbabilities(dartboard).calcProbabilities(gaussian, stride=stride)
+        self.calcCandidates(probabilities, stride, per_region)
+
+        # Finish probability and aim for each score, by darts left in the visit
+        self.finish = None
+        self.finish_aims = None
+        # Expected darts to finish from the start of a visit, for each score
+        # solved so far (0 is finished and 1 cannot be finished)
+        self.darts = np.full(max_score + 1, np.inf)
+        self.darts[0] = 0
+        self.solved = 1
+
+    def calcCandidates(self, probabilities, stride, per_region):
+        """Picks the candidate aim points and groups the regions into outcomes.
+           For each region, the per_region aim points most likely to hit it
+           are candidates.
+
+        Args:
+            probabilities (3D float array): hit probabilities from
+                                            HitProbabilities.calcProbabilities.
+            stride (int): spacing in pixels of the aim points.
+            per_region (int): number of candidates for each region.
+        """
+        flat = probabilities.reshape(len(probabilities), -1)
+        candidates = np.unique(np.argpartition(flat[1:], -per_region, axis=1)[:, -per_region:])
+        self.aims = np.stack(np.unravel_index(candidates, probabilities.shape[1:]), axis=1) * stride
+
+        values = Dartboard.scoringValues()[:len(probabilities)].astype(int)
+        doubles = np.zeros(len(probabilities), dtype=bool)
+        doubles[Dartboard.DOUBLE:Dartboard.DOUBLE + 20] = True
+        doubles[Dartboard.BULL] = True
+
+        outcomes, outcome = np.unique(values * 2 + doubles, return_inverse=True)
+        self.values = outcomes // 2
+        self.doubles = outcomes % 2 == 1
+        # Probability of each outcome (O x A) when aiming at each candidate
+        self.hits = np.zeros((len(outcomes), len(candidates)))
+        np.add.at(self.hits, outcome, flat[:, candidates])
+
+    def transitions(self, scores):
+        """Finds the score left by each outcome from each score.
+
+        Args:
+            scores (1D int array): the scores being thrown at.
+
+        Returns:
+            Tuple (2D int array, 2D bool array, 2D bool array): the score left,
+                whether it finishes and whether it busts, each (O x len(scores)).
+        """
+        left = scores[None, :] - self.values[:, None]
+        finished = (left == 0) & self.doubles[:, None]
+        bust = (left < 2) & ~finished
+        return left, finished, bust
+
+    def calcFinishTable(self):
+        """Calculates the probability of finishing from every score within 1, 2
+           and 3 darts (the rest of a visit), aiming at the best candidate with
+           every dart.
+        """
+        scores = np.arange(self.max_score + 1)
+        left, finished, bust = self.transitions(scores)
+        self.finish = np.zeros((4, len(scores)))
+        self.finish_aims = np.zeros((4, len(scores)), dtype=int)
+        for darts in range(1, 4):
+            # Probability of finishing after each outcome
+            after = np.where(finished, 1.0, 0.0)
+            after[~finished & ~bust] = self.finish[darts - 1][left[~finished & ~bust]]
+            probability = self.hits.T @ after
+            self.finish_aims[darts] = probability.argmax(axis=0)
+            self.finish[darts] = probability.max(axis=0)
+
+    def stageCosts(self, scores, start, darts, start_darts, next_darts):
+        """Calculates the expected darts to finish when aiming at each candidate
+           from each score, part way through a visit.
+
+        Args:
+            scores (1D int array): the scores being thrown at.
+            start (int): score at the start of the visit.
+            darts (int): darts left in the visit, including this one.
+            start_darts (float): expected darts to finish from the start of the
+                                 visit (where a bust returns to).
+            next_darts (1D float array): expected darts to finish from each
+                                         score with one less dart left.
+
+        Returns:
+            2D float array: expected darts to finish, (A x len(scores)).
+        """
+        left, finished, bust = self.transitions(scores)
+        # A bust wastes the rest of the visit
+        cost = np.where(bust, darts - 1 + start_darts, 0.0)
+        carry_on = ~finished & ~bust
+        cost[carry_on] = next_darts[left[carry_on]]
+        return 1 + self.hits.T @ cost
+
+    def solveVisit(self, start):
+        """Calculates the expected darts to finish from the start of a visit on
+           the score, once every lower score is solved. A bust returns to this
+           score, so its value depends on itself, the fixed point is found by
+           secant iteration (the value of the visit is a concave, piecewise
+           linear function of the value returned to).
+
+        Args:
+            start (int): score at the start of the visit.
+        """
+        # Scores reachable with the second and third darts of the visit
+        left, _, bust = self.transitions(np.array([start]))
+        second = np.unique(left[~bust & (left > 0)])
+        left, _, bust = self.transitions(second)
+        third = np.unique(left[~bust & (left > 0)])
+
+        def visitDarts(x):
+            darts = self.darts.copy()
+            darts[start] = x
+            darts[third] = self.stageCosts(third, start, 1, x, darts).min(axis=0)
+            darts[second] = self.stageCosts(second, start, 2, x, darts).min(axis=0)
+            return self.stageCosts(np.array([start]), start, 3, x, darts).min()
+
+        x0 = self.darts[start - 1] + 1 if start > 2 else 3.0
+        f0 = visitDarts(x0)
+        x1 = f0
+        f1 = visitDarts(x1)
+        for _ in range(100):
+            if abs(f1 - x1) < 1e-9:
+                break
+            g0, g1 = f0 - x0, f1 - x1
+            x2 = x1 - g1 * (x1 - x0) / (g1 - g0) if g1 != g0 else f1
+            x0, f0, x1, f1 = x1, f1, x2, visitDarts(x2)
+        self.darts[start] = f1
+
+    def solveTo(self, score):
+        """Solves the expected darts to finish for every score up to score.
+
+        Args:
+            score (int): the highest score to solve.
+        """
+        for start in range(self.solved + 1, score + 1):
+            self.solveVisit(start)
+        self.solved = max(self.solved, score)
+
+    def bestAim(self, score, darts=3, objective="finish", start=None):
+        """Finds the best point to aim at.
+
+        Args:
+            score (int): the score left.
+            darts (int, optional): darts left in the visit. Defaults to 3.
+            objective (string, optional): "finish" to maximise the probability
+                                          of finishing in this visit or "darts"
+                                          to minimise the expected darts to
+                                          finish. Defaults to "finish".
+            start (int, optional): score at the start of the visit, only needed
+                                   for "darts" part way through a visit.
+                                   Defaults to score.
+
+        Returns:
+            Tuple (Tuple (int, int), float): the point (y, x) to aim at and its
+                                             finish probability or expected
+                                             darts.
+        """
+        if not 2 <= score <= self.max_score:
+            raise ValueError(f"Score must be between 2 and {self.max_score}, not {score}")
+        if objective == "finish":
+            if self.finish is None:
+                self.calcFinishTable()
+            return tuple(self.aims[self.finish_aims[darts][score]]), self.finish[darts][score]
+        elif objective == "darts":
+            if start is None:
+                start = score
+            self.solveTo(start)
+            if darts == 3:
+                costs = self.stageCosts(np.array([score]), start, 3, self.darts[start], self.darts)[:, 0]
+            else:
+                # Expected darts from each score with one less dart left
+                next_darts = self.darts.copy()
+                if darts == 2:
+                    left, _, bust = self.transitions(np.array([score]))
+                    third = np.unique(left[~bust & (left > 0)])
+                    next_darts[third] = self.stageCosts(third, start, 1, self.darts[start], self.darts).min(axis=0)
+                costs = self.stageCosts(np.array([score]), start, darts, self.darts[start], next_darts)[:, 0]
+            best = costs.argmin()
+            return tuple(self.aims[best]), costs[best]
+        raise ValueError(f"Unknown objective: {objective}")
@@ -1,20 +1,345 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+import json
+
+
+def compactArray(values):
+    """Converts an array of board values to the smallest dtype that holds every 
+       value exactly.
+
+    Args:
+        values (numpy array): the values.
+
+    Returns:
+        numpy array: the values, as uint8, int16, int32, float32 or float64.
+    """
+    values = np.asarray(values)
+    for dtype in (np.uint8, np.int16, np.int32, np.float32):
+        compact = values.astype(dtype)
+        if np.array_equal(compact, values):
+            return compact
+    return values.astype(np.float64)
 
 
 """Representation of a dartboard, including dartboard values. 
-   A 2D numpy array holds the dartboard values at each position.
+   A 2D uint8 numpy array holds the region of the dartboard (e.g. treble 20 or 
+   the outer bull) at each position, and a value table holds the score of each
+   region. The 2D board of values is derived from these when first needed, so
+   changing the scoring rules only needs a new value table.
+   Boards of values (e.g. loaded from older dartboard.npy files) can still be 
+   set directly, in which case there is no region map.
 """
 class Dartboard:
+    # Region IDs. Number regions hold base + number - 1, e.g. TREBLE + 19 is 
+    # treble 20
+    MISS = 0
+    INNER_SINGLE = 1
+    TREBLE = 21
+    OUTER_SINGLE = 41
+    DOUBLE = 61
+    OUTER_BULL = 81
+    BULL = 82
+    # Points on a wire, only used in the wired regions
+    WIRE = 83
+    NUM_REGIONS = 84
+    
+    # Board files start with the magic bytes, the format version (uint8) and 
+    # the length of the JSON header (uint32), arrays start on page boundaries
+    # so they can be memory mapped
+    FILE_MAGIC = b"DARTBOARD"
+    FILE_VERSION = 1
+    FILE_ALIGNMENT = 4096
+    
     def __init__(self, size):
-        self.board = np.zeros(shape=size)
-        # Holds copy of the board that contains 0s along the wires
-        self.wired_board = np.zeros(shape=size)
-        # Boolean matrix to state whether hit the board or not
-        self.board_mask = np.ones(shape=size, dtype=bool)
+        # Boards of values, derived from the region maps when first used
+        self._board = None
+        self._wired_board = None
+        self._regions = None
+        self._wired_regions = None
+        
+        # Region ID at each point, with every point on the board given the 
+        # region it belongs to
+        self.regions = np.zeros(shape=size, dtype=np.uint8)
+        # Holds copy of the regions that contains WIRE along the wires
+        self.wired_regions = np.zeros(shape=size, dtype=np.uint8)
+        self.values = self.scoringValues()
+        # Boolean matrix to state whether hit the board or not, found from the
+        # regions unless set
+        self.board_mask = None
         
         self.centre_pt = tuple((int(size[0]/2), int(size[1]/2)))  # y, x
+        # Resolution and radius (in pixels) of the board, if known
+        self.pixels_per_mm = None
+        self.radius = None
+    
+    @classmethod
+    def numberRegions(cls, number):
+        """Gives the region IDs of a number on the dartboard.
+
+        Args:
+            number (int): the number, 1 to 20.
+
+        Returns:
+            List [int]: region IDs of the inner single, treble, outer single and
+                        double of the number, from the centre outwards.
+        """
+        return [base + number - 1 for base in (cls.INNER_SINGLE, cls.TREBLE, cls.OUTER_SINGLE, cls.DOUBLE)]
+    
+    @classmethod
+    def scoringValues(cls, rules="standard"):
+        """Builds the value table for a set of scoring rules.
+
+        Args:
+            rules (string, optional): "standard" for the normal score of each 
+                                      region, "doubles" to only score the 
+                                      doubles and the bull (the regions that 
+                                      can finish a leg), or "cricket" to only 
+                                      score 15 to 20 and the bulls. Defaults to
+                                      "standard".
+
+        Returns:
+            1D float array: value of each region ID.
+        """
+        numbers = np.arange(1, 21, dtype=float)
+        values = np.zeros(cls.NUM_REGIONS)
+        values[cls.INNER_SINGLE:cls.INNER_SINGLE + 20] = numbers
+        values[cls.TREBLE:cls.TREBLE + 20] = 3 * numbers
+        values[cls.OUTER_SINGLE:cls.OUTER_SINGLE + 20] = numbers
+        values[cls.DOUBLE:cls.DOUBLE + 20] = 2 * numbers
+        values[cls.OUTER_BULL] = 25
+        values[cls.BULL] = 50
+        
+        if rules == "doubles":
+            finishing = np.zeros(cls.NUM_REGIONS, dtype=bool)
+            finishing[cls.DOUBLE:cls.DOUBLE + 20] = True
+            finishing[cls.BULL] = True
+            values[~finishing] = 0
+        elif rules == "cricket":
+            cricket = np.zeros(cls.NUM_REGIONS, dtype=bool)
+            for base in (cls.INNER_SINGLE, cls.TREBLE, cls.OUTER_SINGLE, cls.DOUBLE):
+                cricket[base + 14:base + 20] = True
+            cricket[[cls.OUTER_BULL, cls.BULL]] = True
+            values[~cricket] = 0
+        elif rules != "standard":
+            raise ValueError(f"Unknown scoring rules: {rules}")
+        return values
+    
+    def setScoring(self, values):
+        """Changes the value of each region, the board is recalculated from the
+           regions the next time it is used. Raises a ValueError for a board 
+           with no region map (e.g. loaded from a .npy file of values).
+
+        Args:
+            values (string or 1D array): the name of a set of scoring rules (see
+                                         scoringValues) or the value of each 
+                                         region ID (length NUM_REGIONS).
+        """
+        if isinstance(values, str):
+            values = self.scoringValues(values)
+        values = np.asarray(values, dtype=float)
+        if values.shape != (self.NUM_REGIONS,):
+            raise ValueError(f"Value table must have {self.NUM_REGIONS} entries, not {values.shape}")
+        self.values = values
+    
+    @property
+    def regions(self):
+        return self._regions
+    
+    @regions.setter
+    def regions(self, regions):
+        self._regions = regions
+        self.clearBoards()
+    
+    @property
+    def wired_regions(self):
+        return self._wired_regions
+    
+    @wired_regions.setter
+    def wired_regions(self, wired_regions):
+        self._wired_regions = wired_regions
+        self.clearBoards()
+    
+    @property
+    def values(self):
+        return self._values
+    
+    @values.setter
+    def values(self, values):
+        if self._regions is None:
+            # The board values were set directly, there are no regions to 
+            # apply the table to
+            raise ValueError("Cannot change the value table of a board with no region map")
+        self._values = values
+        self.clearBoards()
+    
+    def clearBoards(self):
+        """Forgets the derived boards, so they are recalculated from the regions
+           next time they are used. Needed after changing the regions in place.
+           Boards of values set directly (with no region map) are kept.
+        """
+        if self._regions is not None:
+            self._board = None
+        if self._wired_regions is not None:
+            self._wired_board = None
+    
+    @property
+    def board(self):
+        """2D array: the board value at each point, in the smallest dtype that
+           holds the value table exactly (uint8 for the standard scoring)."""
+        if self._board is None:
+            self._board = compactArray(self.values)[self.regions]
+        return self._board
+    
+    @board.setter
+    def board(self, board):
+        # A board of values with no region map
+        self._regions = None
+        self._board = board
+    
+    @property
+    def wired_board(self):
+        """2D array: the board value at each point, with 0s along the wires, in
+           the same dtype as board."""
+        if self._wired_board is None:
+            self._wired_board = compactArray(self.values)[self.wired_regions]
+        return self._wired_board
+    
+    @wired_board.setter
+    def wired_board(self, wired_board):
+        self._wired_regions = None
+        self._wired_board = wired_board
+    
+    @property
+    def shape(self):
+        """Tuple (int, int): height and width of the board."""
+        if self.regions is not None:
+            return self.regions.shape
+        return self.board.shape
+    
+    @property
+    def board_mask(self):
+        """2D bool array: whether each point is on the board or not."""
+        if self._board_mask is not None:
+            return self._board_mask
+        if self.regions is None:
+            return np.ones(self.shape, dtype=bool)
+        return self.regions != self.MISS
+    
+    @board_mask.setter
+    def board_mask(self, board_mask):
+        self._board_mask = board_mask
+    
+    def save(self, filename):
+        """Saves the dartboard to a board file: the region maps (or for a board 
+           of values with no region map, the values in the smallest dtype that 
+           holds them exactly), the value table and the metadata, in a form 
+           that open can memory map.
+
+        Args:
+            filename (string): name of the file to save to.
+        """
+        if self.regions is not None:
+            arrays = {'regions': self.regions}
+            if self.wired_regions is not None:
+                arrays['wired_regions'] = self.wired_regions
+        else:
+            arrays = {'board': compactArray(self.board)}
+            if self._wired_board is not None:
+                arrays['wired_board'] = compactArray(self._wired_board)
+        if self._board_mask is not None:
+            arrays['board_mask'] = self._board_mask
+        arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        
+        header = {'version': self.FILE_VERSION, 
+                  'shape': list(self.shape), 
+                  'centre': [int(c) for c in self.centre_pt], 
+                  'pixels_per_mm': self.pixels_per_mm, 
+                  'radius': None if self.radius is None else float(self.radius), 
+                  'values': self.values.tolist(), 
+                  'arrays': {}}
+        
+        # The array offsets depend on the header length, recalculate until the
+        # header stops growing
+        start = 0
+        while True:
+            offset = start
+            for name, array in arrays.items():
+                header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+                offset = -(-(offset + array.nbytes) // self.FILE_ALIGNMENT) * self.FILE_ALIGNMENT
+            text = json.dumps(header).encode()
+            prefix = len(self.FILE_MAGIC) + 1 + 4 + len(text)
+            if prefix <= start:
+                break
+            start = -(-prefix // self.FILE_ALIGNMENT) * self.FILE_ALIGNMENT
+        
+        with open(filename, 'wb') as f:
+            f.write(self.FILE_MAGIC)
+            f.write(np.uint8(self.FILE_VERSION).tobytes())
+            f.write(np.uint32(len(text)).astype('<u4').tobytes())
+            f.write(text)
+            for name, array in arrays.items():
+                f.seek(header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+    
+    @classmethod
+    def open(cls, filename):
+        """Opens a board file written by save. The arrays are memory mapped 
+           read only, so opening takes milliseconds and processes opening the 
+           same file share its pages instead of each holding a copy.
+
+        Args:
+            filename (string): name of the file to open.
+
+        Returns:
+            Dartboard: the dartboard, with read only arrays.
+        """
+        with open(filename, 'rb') as f:
+            magic = f.read(len(cls.FILE_MAGIC))
+            if magic != cls.FILE_MAGIC:
+                raise ValueError(f"{filename} is not a board file")
+            version = f.read(1)[0]
+            if version > cls.FILE_VERSION:
+                raise ValueError(f"{filename} is board file version {version}, only up to {cls.FILE_VERSION} is supported")
+            length = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+            header = json.loads(f.read(length))
+        
+        arrays = {name: np.memmap(filename, mode='r', dtype=info['dtype'], shape=tuple(info['shape']), offset=info['offset']) 
+                  for name, info in header['arrays'].items()}
+        
+        db = cls(tuple(header['shape']))
+        db.centre_pt = tuple(header['centre'])
+        db.pixels_per_mm = header['pixels_per_mm']
+        db.radius = header['radius']
+        db.values = np.array(header['values'])
+        if 'regions' in arrays:
+            db.regions = arrays['regions']
+        else:
+            db.board = arrays['board']
+        if 'wired_regions' in arrays:
+            db.wired_regions = arrays['wired_regions']
+        if 'wired_board' in arrays:
+            db.wired_board = arrays['wired_board']
+        db.board_mask = arrays.get('board_mask')
+        return db
+    
+    def calcCircularMask(self, radius, centre=None):
+        """Sets the board mask to True for every point within radius of the 
+           centre of the board and False outside it. Built from a broadcast 
+           grid of distances, so works for boards of any size.
+
+        Args:
+            radius (float): radius of the dartboard in pixels.
+            centre (Tuple (int, int), optional): centre point (y, x) of the 
+                                                 dartboard. Defaults to the 
+                                                 centre of the array.
+
+        Returns:
+            2D bool array: the board mask.
+        """
+        if centre is None:
+            centre = self.centre_pt
+        y, x = np.ogrid[:self.shape[0], :self.shape[1]]
+        self.board_mask = np.sqrt((centre[0] - y)**2 + (centre[1] - x)**2) <= radius
+        return self.board_mask
     
     def printBoardSection(self, centre, r):
         """Prints a square section of the dartboard to console of radius r 
@@ -74,12 +399,15 @@ class Dartboard:
         new_y = self.board.shape[1] - 1 - x
         return (new_x, new_y)
     
-    def graphBoard(self, spacing=5, kernel_size=None, kernel_centres=[]):
+    def graphBoard(self, spacing=5, kernel_size=None, kernel_centres=[], raster=False, heatmap=None, filename="maxima.png", show=True):
         """Displays the dartboard board in the form of a graph.
            Each point in the dartboard is looped through, skipping out the values
            for the given spacing and the integer value held at that point on the 
            dartboard is added to the graph in text at the corresponding location.
-           If the kernel details are given, the kernel square is displayed over
+           In raster mode the whole board (or a heatmap, such as an expected 
+           value map) is instead drawn as a single image with a colour map, 
+           which is much faster to draw and save.
+           If the kernel details are given, the kernel circle is displayed over
            its location on the dartboard.
 
         Args:
@@ -93,12 +421,6 @@ class Dartboard:
                                          provided, the kernel will be displayed 
                                          as a scaled square over its given location 
                                          on the dartboard. Defaults to None.
-            kernel_centres (List [Tuple (int, int)], optional): The centre point (x, y)
-                                                        If provided, the kernel 
-                                                        will be displayed as a 
-                                                        scaled square over its 
-                                                        given location on the dartboard. 
-                                                        Defaults to None.
             kernel_centres (list of tuple(int, int), optional): A list of centre points 
                                                         (x, y) that have been used 
                                                         during gradient descent 
@@ -109,49 +431,75 @@ class Dartboard:
                                                         size kernel_size is graphed
                                                         at that position
                                                         Defaults to None.
+            raster (bool, optional): draw the board as an image instead of text.
+                                     Defaults to False.
+            heatmap (2D float array, optional): values to draw instead of the 
+                                                board in raster mode, same shape
+                                                as the board. Defaults to None.
+            filename (string, optional): file to save the graph to. Defaults to
+                                         "maxima.png".
+            show (bool, optional): display the graph in a window. If False, the
+                                   graph is only saved, without using pyplot,
+                                   so it works without a display. Defaults to 
+                                   True.
         """
+        from matplotlib.patches import Circle
+        from matplotlib.collections import PatchCollection
         
-        plt.figure(figsize=(12, 12), dpi=80)
+        if show:
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize=(12, 12), dpi=80)
+        else:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure(figsize=(12, 12), dpi=80)
+            FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
         
         if type(kernel_centres) != list:
             kernel_centres = [kernel_centres]
         
-        # Display kernel rectangle at each kernel position in kernel_centres
+        # Display kernel circle at each kernel position in kernel_centres, as
+        # one collection
         if kernel_size != None and len(kernel_centres) != 0:
-            for i, centre in enumerate(kernel_centres):
-                c = self.convertToGraphCoords(centre)
-                # Move from centre to top left
-                top_left = (c[0] - (kernel_size/2), c[1] - (kernel_size/2))
-                # If displaying last kernel position (the maxima) use a green colour
-                if i == len(kernel_centres) - 1:
-                    edge_colour = 'g'
-                else:
-                    edge_colour = 'r'
-                # square = plt.Rectangle(top_left, kernel_size, kernel_size, linewidth=2, edgecolor=edge_colour)
-                # plt.gca().add_patch(square)
-                circle = plt.Circle(xy=c, radius=kernel_size/2, linewidth=2, edgecolor=edge_colour)
-                plt.gca().add_patch(circle)
-        
-        if kernel_size > 20:
-            # Display small green dot at exact point of maxima 
-            # plt.plot(1200 - kernel_centres[-1][1], 1200 - kernel_centres[-1][0], 'go')
-            circle = plt.Circle(xy=(kernel_centres[-1][1], 1200 - kernel_centres[-1][0]), radius=4, linewidth=2, edgecolor='w')
-            plt.gca().add_patch(circle)
-        
-        # Plot dartboard values
-        for i in range(0, self.board.shape[0], spacing):
-            for j in range(0, self.board.shape[1], spacing):
-                x, y = self.convertToGraphCoords((i, j))
-                
-                if self.board[i][j] != 0:
-                    plt.text(x, y, str(self.board[i][j]), fontsize=6)
-
-        plt.xlim([100, 1100])
-        plt.ylim([100, 1100])
-        plt.axis('off')
-        plt.tight_layout(pad=0)
-        plt.annotate(f'Kernel size = {kernel_size}', xy=(150, 1050), size=20)
-        plt.savefig("maxima.png", bbox_inches='tight')
-        plt.show()
-
+            circles = [Circle(xy=self.convertToGraphCoords(centre), radius=kernel_size/2) for centre in kernel_centres]
+            # If displaying last kernel position (the maxima) use a green colour
+            edge_colours = ['r'] * (len(circles) - 1) + ['g']
+            ax.add_collection(PatchCollection(circles, linewidth=2, edgecolors=edge_colours, 
+                                              facecolors='none' if raster else 'C0'))
+        
+            if kernel_size > 20:
+                # Display small dot at exact point of maxima 
+                ax.add_patch(Circle(xy=self.convertToGraphCoords(kernel_centres[-1]), radius=4, linewidth=2, edgecolor='w'))
+        
+        height, width = self.shape
+        if raster:
+            # Plot dartboard values (or the heatmap) as one image, row i is at
+            # graph y = width - 1 - i (see convertToGraphCoords)
+            image = self.board if heatmap is None else heatmap
+            ax.imshow(image, cmap='viridis', origin='upper', interpolation='nearest', zorder=0, 
+                      extent=(-0.5, width - 0.5, width - height - 0.5, width - 0.5))
+        else:
+            # Plot dartboard values
+            for i in range(0, height, spacing):
+                for j in range(0, width, spacing):
+                    x, y = self.convertToGraphCoords((i, j))
+                    
+                    if self.board[i][j] != 0:
+                        ax.text(x, y, str(self.board[i][j]), fontsize=6)
 
+        # Show just past the edge of the board
+        if self.radius is not None:
+            centre = self.convertToGraphCoords(self.centre_pt)
+            reach = self.radius * 1.1
+            ax.set_xlim([centre[0] - reach, centre[0] + reach])
+            ax.set_ylim([centre[1] - reach, centre[1] + reach])
+        else:
+            ax.set_xlim([-0.5, width - 0.5])
+            ax.set_ylim([width - height - 0.5, width - 0.5])
+        ax.axis('off')
+        fig.tight_layout(pad=0)
+        ax.annotate(f'Kernel size = {kernel_size}', xy=(0.05, 0.95), xycoords='axes fraction', size=20)
+        fig.savefig(filename, bbox_inches='tight')
+        if show:
+            plt.show()
@@ -0,0 +1,205 @@
+from gaussian import Gaussian, pixelSigma
+import numpy as np
+
+
+"""Stores precomputed expected value maps for a range of kernel sizes, so where
+   to aim (and the expected value of aiming anywhere) can be looked up instead
+   of searched for. For each kernel size, the expected value map is kept at
+   every stride-th point, along with the best local maxima of the full map.
+   Everything is saved in one compressed .npz file with one entry per map, so
+   a query only loads the maps it needs. Kernel sizes between the stored sizes
+   are answered by interpolating linearly in the standard deviation (in pixels)
+   of the kernel.
+"""
+class ExpectedValueStore():
+    def __init__(self, filename):
+        """Opens a store written by build.
+
+        Args:
+            filename (string): name of the .npz file.
+        """
+        self.file = np.load(filename)
+        self.kernel_sizes = self.file['kernel_sizes']
+        self.sigmas = self.file['sigmas']
+        self.sigma = float(self.file['sigma'])
+        self.stride = int(self.file['stride'])
+        self.shape = tuple(self.file['shape'])
+        self.maxima_points = self.file['maxima_points']
+        self.maxima_values = self.file['maxima_values']
+        # Maps loaded so far, by index into kernel_sizes
+        self.maps = {}
+
+    @classmethod
+    def build(cls, dartboard, kernel_sizes, filename, sigma=0.3, stride=4, maxima=10):
+        """Calculates the expected value maps and their best local maxima for
+           each kernel size and saves them.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                      to represent the dartboard. Each element
+                                      holds the board value found on a dartboard
+                                      at that location.
+            kernel_sizes (iterable of float): the kernel sizes to store.
+            filename (string): name of the .npz file to write.
+            sigma (float, optional): the standard deviation of the Gaussian
+                                     distribution. Defaults to 0.3.
+            stride (int, optional): spacing in pixels of the stored map points.
+                                    Defaults to 4.
+            maxima (int, optional): number of local maxima to store for each
+                                    kernel size. Defaults to 10.
+
+        Returns:
+            ExpectedValueStore: the store, opened from the file.
+        """
+        dartboard = np.asarray(dartboard, dtype=float)
+        kernel_sizes = np.array(sorted(kernel_sizes), dtype=float)
+        gaussian = Gaussian()
+
+        # One FFT of the board, at the size needed by the largest kernel
+        gaussian.calcCircularGaussianSize(kernel_sizes[-1], sigma=sigma)
+        fft_shape = gaussian.fftShape(dartboard.shape)
+        board_spectrum = np.fft.rfft2(dartboard, s=fft_shape)
+
+        arrays = {}
+        maxima_points = np.full((len(kernel_sizes), maxima, 2), -1)
+        maxima_values = np.full((len(kernel_sizes), maxima), np.nan)
+        for i, kernel_size in enumerate(kernel_sizes):
+            gaussian.calcCircularGaussianSize(kernel_size, sigma=sigma)
+            expected_values = gaussian.calcExpectedValues(dartboard, board_spectrum, fft_shape)
+            arrays[f'map_{i}'] = expected_values[::stride, ::stride].astype(np.float32)
+
+            points = cls.localMaxima(expected_values, maxima, separation=max(kernel_size / 2, stride))
+            maxima_points[i, :len(points)] = points
+            maxima_values[i, :len(points)] = expected_values[points[:, 0], points[:, 1]]
+
+        sigmas = [pixelSigma(sigma, kernel_size) for kernel_size in kernel_sizes]
+        np.savez_compressed(filename, kernel_sizes=kernel_sizes, sigmas=sigmas, sigma=sigma, stride=stride,
+                            shape=dartboard.shape, maxima_points=maxima_points, maxima_values=maxima_values, **arrays)
+        return cls(filename)
+
+    @staticmethod
+    def localMaxima(expected_values, count, separation):
+        """Finds the best local maxima of an expected value map, at least
+           separation pixels apart (so a flat top only gives one point).
+
+        Args:
+            expected_values (2D float array): expected value map.
+            count (int): most maxima to return.
+            separation (float): smallest distance between two maxima.
+
+        Returns:
+            2D int array: the (y, x) points of the maxima, best first.
+        """
+        # Points no lower than any of their 8 neighbours
+        padded = np.pad(expected_values, 1, constant_values=-np.inf)
+        neighbours = np.lib.stride_tricks.sliding_window_view(padded, (3, 3)).max(axis=(-2, -1))
+        ys, xs = np.nonzero((expected_values >= neighbours) & (expected_values > 0))
+        order = np.argsort(-expected_values[ys, xs], kind='stable')
+
+        points = []
+        for y, x in zip(ys[order], xs[order]):
+            if all((y - py)**2 + (x - px)**2 >= separation**2 for py, px in points):
+                points.append((y, x))
+                if len(points) == count:
+                    break
+        return np.array(points, dtype=int).reshape(-1, 2)
+
+    def kernelMap(self, i):
+        """Returns the stored map of a kernel size, loading it on first use.
+
+        Args:
+            i (int): index of the kernel size in kernel_sizes.
+
+        Returns:
+            2D float32 array: expected value at every stride-th point.
+        """
+        if i not in self.maps:
+            self.maps[i] = self.file[f'map_{i}']
+        return self.maps[i]
+
+    def neighbours(self, kernel_size):
+        """Finds the stored kernel sizes either side of a kernel size and how
+           far between them it is, by standard deviation in pixels.
+
+        Args:
+            kernel_size (float): the kernel size.
+
+        Returns:
+            Tuple (int, int, float): indexes of the lower and higher stored
+                                     sizes, and the weight of the higher one.
+        """
+        if not self.kernel_sizes[0] <= kernel_size <= self.kernel_sizes[-1]:
+            raise ValueError(f"Kernel size {kernel_size} outside the stored range "
+                             f"{self.kernel_sizes[0]} to {self.kernel_sizes[-1]}")
+        higher = int(np.searchsorted(self.kernel_sizes, kernel_size))
+        if self.kernel_sizes[higher] == kernel_size:
+            return higher, higher, 0.0
+        lower = higher - 1
+        sigma = pixelSigma(self.sigma, kernel_size)
+        weight = (sigma - self.sigmas[lower]) / (self.sigmas[higher] - self.sigmas[lower])
+        return lower, higher, weight
+
+    def mapValue(self, i, point):
+        """Returns the expected value of a stored kernel size at a point, exact
+           for the stored maxima and bilinearly interpolated from the map
+           otherwise.
+
+        Args:
+            i (int): index of the kernel size in kernel_sizes.
+            point (Tuple (int, int)): the point (y, x).
+
+        Returns:
+            float: the expected value.
+        """
+        exact = (self.maxima_points[i] == point).all(axis=1)
+        if exact.any():
+            return float(self.maxima_values[i][exact.argmax()])
+
+        values = self.kernelMap(i)
+        y, x = point[0] / self.stride, point[1] / self.stride
+        y0 = min(max(int(np.floor(y)), 0), values.shape[0] - 1)
+        x0 = min(max(int(np.floor(x)), 0), values.shape[1] - 1)
+        y1, x1 = min(y0 + 1, values.shape[0] - 1), min(x0 + 1, values.shape[1] - 1)
+        fy, fx = min(max(y - y0, 0), 1), min(max(x - x0, 0), 1)
+        top = values[y0, x0] * (1 - fx) + values[y0, x1] * fx
+        bottom = values[y1, x0] * (1 - fx) + values[y1, x1] * fx
+        return float(top * (1 - fy) + bottom * fy)
+
+    def expectedValue(self, kernel_size, point):
+        """Returns the expected value of aiming at a point.
+
+        Args:
+            kernel_size (float): the kernel size.
+            point (Tuple (int, int)): the point (y, x).
+
+        Returns:
+            float: the expected value.
+        """
+        lower, higher, weight = self.neighbours(kernel_size)
+        value = self.mapValue(lower, point)
+        if higher != lower:
+            value = value * (1 - weight) + self.mapValue(higher, point) * weight
+        return value
+
+    def bestAim(self, kernel_size):
+        """Returns the best point to aim at and its expected value. For a stored
+           kernel size this is the best stored maximum, between stored sizes it
+           is the best of the stored maxima of both sizes, by interpolated
+           expected value.
+
+        Args:
+            kernel_size (float): the kernel size.
+
+        Returns:
+            Tuple (Tuple (int, int), float): the point (y, x) and its expected
+                                             value.
+        """
+        lower, higher, weight = self.neighbours(kernel_size)
+        if higher == lower:
+            return tuple(int(c) for c in self.maxima_points[lower][0]), float(self.maxima_values[lower][0])
+
+        candidates = [tuple(int(c) for c in point) for i in (lower, higher)
+                      for point in self.maxima_points[i] if point[0] >= 0]
+        values = [self.expectedValue(kernel_size, point) for point in candidates]
+        best = int(np.argmax(values))
+        return candidates[best], values[best]
@@ -1,14 +1,216 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm
+import os
+from collections import OrderedDict
+
+def fastLength(n):
+    """Returns the smallest length >= n with no prime factors other than 2, 3 
+       and 5, which the FFT handles efficiently.
+
+    Args:
+        n (int): minimum length.
+
+    Returns:
+        int: fast FFT length.
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def pixelSigma(sigma, size):
+    """Converts the sigma used to build a kernel (in units of the kernel's half
+       width, as in calcCircularGaussian) to a standard deviation in pixels.
+
+    Args:
+        sigma (float): the standard deviation used to build the kernel.
+        size (int): the size of one side of the kernel.
+
+    Returns:
+        float: the standard deviation in pixels.
+    """
+    return sigma * (size - 1) / 2
+
+
+def kernelCentre(size):
+    """Returns the offset in pixels from the aim point to the centre of a
+       kernel of the given size, as applied by applyGaussian (which starts the
+       kernel ceil(size/2) before the point).
+
+    Args:
+        size (int): the size of one side of the kernel.
+
+    Returns:
+        float: offset of the kernel centre from the point.
+    """
+    return (size - 1) / 2 - (size + 1) // 2
+
+
+def gaussianCorrelate(values, sigma, shift=0.0, truncate=4, block=16):
+    """Correlates a 2D array with a sampled Gaussian along both axes, giving 
+       out[p] = sum over t of values[p + t] * w(t - shift) along each axis, 
+       with w cut off truncate standard deviations from its centre and values
+       outside the array taken as zeros. Each axis is one matrix product of
+       overlapping windows of the array with a band of the weights, block 
+       outputs per window, so the cost grows with the width of the Gaussian 
+       rather than the size of the array. For a Gaussian a few pixels wide 
+       this is faster than an inverse FFT of the array.
+
+    Args:
+        values (2D float array): the array to correlate.
+        sigma (float): standard deviation of the Gaussian in pixels.
+        shift (float, optional): offset of the Gaussian centre along both axes.
+                                 Defaults to 0.
+        truncate (float, optional): standard deviations from the centre to 
+                                    cut the Gaussian off at. Defaults to 4.
+        block (int, optional): outputs calculated from each window. Defaults 
+                               to 16.
+
+    Returns:
+        2D float array: the correlated array, same shape as values.
+    """
+    radius = int(np.ceil(truncate * sigma + abs(shift)))
+    t = np.arange(-radius, radius + 1)
+    weights = np.exp(-(t - shift)**2 / (2 * sigma**2))
+    weights = weights / np.sum(weights)
+    
+    # Column i of the band holds the weights, starting at row i
+    band = np.zeros((block + 2*radius, block))
+    for i in range(block):
+        band[i:i + len(weights), i] = weights
+    
+    # Zero pad by the radius, and up to whole blocks
+    height, width = values.shape
+    rows, columns = -(-height // block) * block, -(-width // block) * block
+    padded = np.zeros((rows + 2*radius, columns + 2*radius))
+    padded[radius:radius + height, radius:radius + width] = values
+    
+    # Windows of len(band) columns, block apart, then the same down the rows
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(band), axis=1)[:, ::block]
+    across = (windows @ band).reshape(len(padded), columns)
+    windows = np.lib.stride_tricks.sliding_window_view(across, len(band), axis=0)[::block].transpose(0, 2, 1)
+    return (band.T @ windows).reshape(rows, columns)[:height, :width]
+
+
+# Offsets (y, x) of the 3x3 stencil of points tested during gradient descent:
+# centre, up, down, right, left, up right, up left, down right, down left
+STENCIL = [(0, 0), (-1, 0), (1, 0), (0, 1), (0, -1), (-1, 1), (-1, -1), (1, 1), (1, -1)]
+
+
+"""Caches Gaussian kernels keyed by (shape, sigma, mu, size, dtype), so a 
+   kernel requested again is not rebuilt. Kernels are kept in memory up to 
+   max_bytes, dropping the least recently used kernel when over the limit. If 
+   a folder is given, kernels are also saved there as .npy files and loaded 
+   memory mapped when not in memory, so they are shared between processes and
+   runs. Cached kernels are read only.
+"""
+class KernelCache():
+    def __init__(self, max_bytes=256*1024**2, folder=None):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.kernels = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def filename(self, key):
+        """Returns the path of the file a kernel is saved to in the folder.
+
+        Args:
+            key (Tuple): (shape, sigma, mu, size, dtype) of the kernel.
+
+        Returns:
+            string: the path of the .npy file.
+        """
+        shape, sigma, mu, size, dtype = key
+        return os.path.join(self.folder, f"kernel_{shape}_{sigma!r}_{mu!r}_{size}_{dtype}.npy")
+    
+    def kernel(self, key, build):
+        """Returns the kernel for the key, from memory, from the folder or 
+           built by calling build, in that order of preference.
+
+        Args:
+            key (Tuple): (shape, sigma, mu, size, dtype) of the kernel.
+            build (function): builds the kernel, takes no arguments.
+
+        Returns:
+            2D float array: the read only kernel.
+        """
+        if key in self.kernels:
+            self.hits += 1
+            self.kernels.move_to_end(key)
+            return self.kernels[key]
+        
+        kernel = None
+        if self.folder is not None and os.path.exists(self.filename(key)):
+            self.disk_hits += 1
+            kernel = np.load(self.filename(key), mmap_mode='r')
+        else:
+            self.misses += 1
+            kernel = build()
+            kernel.setflags(write=False)
+            if self.folder is not None:
+                # Write then rename, so other processes never load a part 
+                # written file
+                os.makedirs(self.folder, exist_ok=True)
+                temp = f"{self.filename(key)}.{os.getpid()}.tmp"
+                with open(temp, 'wb') as f:
+                    np.save(f, kernel)
+                os.replace(temp, self.filename(key))
+        
+        if kernel.nbytes <= self.max_bytes:
+            self.kernels[key] = kernel
+            self.nbytes += kernel.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self.kernels.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+                self.evictions += 1
+        return kernel
+    
+    def clear(self):
+        """Drops every kernel held in memory (files in the folder are kept)."""
+        self.kernels.clear()
+        self.nbytes = 0
+    
+    def __str__(self):
+        total = self.hits + self.disk_hits + self.misses
+        rate = (self.hits + self.disk_hits) / total * 100 if total else 0
+        return (f"Kernel cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses "
+                f"({rate:.1f}% hit rate), {self.evictions} evictions, {len(self.kernels)} kernels "
+                f"using {self.nbytes / 1024**2:.1f}MB of {self.max_bytes / 1024**2:.1f}MB")
+
+
+# Kernel cache shared by every Gaussian in the process by default
+KERNEL_CACHE = KernelCache()
+
 
 """Holds the functions to generate and apply 2D Gaussian kernel to a section of
    a dartboard numpy array.
 """
 class Gaussian():
     
-    def __init__(self):
+    def __init__(self, cache=KERNEL_CACHE):
+        """
+        Args:
+            cache (KernelCache, optional): cache to take kernels from. Defaults
+                                           to the shared KERNEL_CACHE, None to
+                                           always build kernels.
+        """
+        self.cache = cache
         self.gaussian = None
+        # Parameters the current kernel was built from (shape, sigma, mu, size,
+        # dtype), identifies the kernel
+        self.params = None
+        # Kernels shifted to each stencil offset, for each distance d
+        self.stencil_kernels = {}
+        # Sum of the analytic kernel used by applyGaussianDerivatives
+        self.derivative_normaliser = None
     
     def calcCircularMask(self, size):
         """Calculates a circular numpy mask, with ones at positions in the circle
@@ -19,50 +221,104 @@ class Gaussian():
             size (int): length of the NxN 2D array, and diameter of the circular 
                         mask.
         """
-        mask = np.ones((size, size), dtype=int)
         radius = (size - 1) / 2
         
-        for i in range(size):
-            for j in range(size):
-                if np.sqrt((i-radius)**2 + (j-radius)**2) > radius + 1:
-                    mask[i][j] = 0
+        # Distance of every element from the centre, from a broadcast grid
+        i = np.arange(size)
+        d = np.sqrt((i[:, None] - radius)**2 + (i[None, :] - radius)**2)
+        mask = (d <= radius + 1).astype(int)
         return mask
             
     
-    def calcCircularGaussian(self, sigma, mu, size):
+    def cachedKernel(self, shape, sigma, mu, size, dtype, build):
+        """Returns the kernel from the cache, or from build if there is no cache.
+
+        Args:
+            shape (string): "circular" or "square".
+            sigma (float): the standard deviation of the Gaussian distribution.
+            mu (float): the mean of the Gaussian distribution.
+            size (int): the size of one side of the kernel (size X size).
+            dtype (numpy dtype): dtype of the kernel.
+            build (function): builds the kernel, takes no arguments.
+
+        Returns:
+            2D float array: the kernel.
+        """
+        if self.cache is None:
+            return build().astype(dtype)
+        key = (shape, float(sigma), float(mu), int(size), np.dtype(dtype).name)
+        return self.cache.kernel(key, lambda: build().astype(dtype))
+    
+    def calcCircularGaussian(self, sigma, mu, size, dtype=np.float64):
         """Calculates and stores a circular Gaussian kernel, with zeros in the
-           corners of the 2D array.
+           corners of the 2D array. Taken from the kernel cache if it holds it.
 
         Args:
             sigma (int): the standard deviation of the Gaussian distribution.
             mu (int): the mean of the Gaussian distribution.
             size (int): the size of one side of the kernel (size X size).
+            dtype (numpy dtype, optional): dtype of the kernel. Defaults to 
+                                           float64.
         """
-        x, y = np.meshgrid(np.linspace(-1,1,size), np.linspace(-1,1,size))
-        d = np.sqrt(x*x + y*y)
-        self.gaussian = np.exp(-((d-mu)**2 / (2.0 * sigma**2)))
-        
-        circular_mask = self.calcCircularMask(size)
-        self.gaussian = self.gaussian * circular_mask
+        def build():
+            x, y = np.meshgrid(np.linspace(-1,1,size), np.linspace(-1,1,size))
+            d = np.sqrt(x*x + y*y)
+            gaussian = np.exp(-((d-mu)**2 / (2.0 * sigma**2)))
+            
+            circular_mask = self.calcCircularMask(size)
+            gaussian = gaussian * circular_mask
             
-        # Normalise
-        self.gaussian = self.gaussian / np.sum(self.gaussian)
+            # Normalise
+            return gaussian / np.sum(gaussian)
+        
+        self.gaussian = self.cachedKernel('circular', sigma, mu, size, dtype, build)
+        self.params = ('circular', sigma, mu, size, np.dtype(dtype).name)
+        self.stencil_kernels = {}
+        self.derivative_normaliser = None
         
         return self.gaussian
 
-    def calcSquareGaussian(self, sigma, mu, size):
-        """Calculates  the Gaussian kernel.
+    def calcCircularGaussianSize(self, kernel_size, sigma=0.3, mu=0):
+        """Calculates a circular Gaussian kernel for a kernel size that may be
+           fractional. The kernel array is ceil(kernel_size) wide and sigma is 
+           scaled so the standard deviation in pixels is the same as a kernel 
+           of exactly kernel_size would have. For whole kernel sizes this is 
+           the same as calcCircularGaussian(sigma, mu, kernel_size).
+
+        Args:
+            kernel_size (float): the size of one side of the kernel.
+            sigma (float, optional): the standard deviation of the Gaussian 
+                                     distribution. Defaults to 0.3.
+            mu (int, optional): the mean of the Gaussian distribution. 
+                                Defaults to 0.
+        """
+        size = int(np.ceil(kernel_size))
+        if size > 1:
+            sigma = sigma * (kernel_size - 1) / (size - 1)
+        return self.calcCircularGaussian(sigma, mu, size)
+
+    def calcSquareGaussian(self, sigma, mu, size, dtype=np.float64):
+        """Calculates  the Gaussian kernel. Taken from the kernel cache if it 
+           holds it.
 
         Args:
             sigma (int): the standard deviation of the Gaussian distribution.
             mu (int): the mean of the Gaussian distribution.
             size (int): the size of one side of the kernel (size X size).
+            dtype (numpy dtype, optional): dtype of the kernel. Defaults to 
+                                           float64.
         """
-        x, y = np.meshgrid(np.linspace(-1,1,size), np.linspace(-1,1,size))
-        d = np.sqrt(x*x + y*y)
-        self.gaussian = np.exp(-((d-mu)**2 / (2.0 * sigma**2)))
-        # Normalise
-        self.gaussian = self.gaussian / np.sum(self.gaussian)
+        def build():
+            x, y = np.meshgrid(np.linspace(-1,1,size), np.linspace(-1,1,size))
+            d = np.sqrt(x*x + y*y)
+            gaussian = np.exp(-((d-mu)**2 / (2.0 * sigma**2)))
+            # Normalise
+            return gaussian / np.sum(gaussian)
+        
+        self.gaussian = self.cachedKernel('square', sigma, mu, size, dtype, build)
+        self.params = ('square', sigma, mu, size, np.dtype(dtype).name)
+        self.stencil_kernels = {}
+        self.derivative_normaliser = None
         
         return self.gaussian
 
@@ -75,6 +331,9 @@ class Gaussian():
             print()
     
     def graphGaussian(self):
+        import matplotlib.pyplot as plt
+        from matplotlib import cm
+        
         x=np.linspace(-self.gaussian.shape[0]/2, self.gaussian.shape[0]/2, 
                       num=self.gaussian.shape[0])
         y=np.linspace(-self.gaussian.shape[1]/2, self.gaussian.shape[1]/2, 
@@ -101,34 +360,355 @@ class Gaussian():
         # plt.show()
                 
     
-    def applyGaussian(self, dartboard, point):
+    def fftShape(self, board_shape):
+        """Returns the FFT size needed to convolve a board of the given shape
+           with the current kernel without wrap-around. The board is zero padded
+           by the size of the kernel, so the kernel can be applied right up to
+           (and past) the edge of the board.
+
+        Args:
+            board_shape (Tuple (int, int)): shape (H, W) of the dartboard array.
+
+        Returns:
+            Tuple (int, int): padded shape to use for the FFT.
+        """
+        return tuple(fastLength(n + len(self.gaussian)) for n in board_shape[-2:])
+
+    def calcExpectedValues(self, dartboard, board_spectrum=None, fft_shape=None):
+        """Applies the Gaussian kernel to every point on the dartboard at once 
+           using an FFT convolution and returns the full expected value map.
+           Element (y, x) of the map holds the same value as 
+           applyGaussian(dartboard, (y, x)), so the global maximum is the argmax
+           of the map. The board is zero padded, so there is no limit on the 
+           size of the kernel relative to the border around the dartboard.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                      to represent the dartboard. Each element 
+                                      holds the board value found on a dartboard 
+                                      at that location.
+            board_spectrum (2D complex array, optional): np.fft.rfft2 of the 
+                                      dartboard at fft_shape, to reuse when 
+                                      applying several kernels to the same 
+                                      board. Defaults to None (calculated here).
+            fft_shape (Tuple (int, int), optional): the shape board_spectrum was
+                                      calculated at. Must be at least 
+                                      fftShape(dartboard.shape).
+
+        Returns:
+            2D float array: expected value of aiming at each point on the 
+                            dartboard, same shape as dartboard.
+        """
+        size = len(self.gaussian)
+        height, width = dartboard.shape[-2:]
+        if fft_shape is None:
+            fft_shape = self.fftShape(dartboard.shape)
+        elif fft_shape[0] < height + size - 1 or fft_shape[1] < width + size - 1:
+            raise ValueError(f"FFT shape {fft_shape} too small for a {size}x{size} kernel")
+        
+        if board_spectrum is None:
+            board_spectrum = np.fft.rfft2(dartboard, s=fft_shape)
+        # Flip the kernel so the convolution matches the multiply-sum of 
+        # applyGaussian (a correlation)
+        kernel_spectrum = np.fft.rfft2(self.gaussian[::-1, ::-1], s=fft_shape)
+        full = np.fft.irfft2(board_spectrum * kernel_spectrum, s=fft_shape)
+        
+        # applyGaussian takes a slice starting ceil(size/2) before the point,
+        # roll the full convolution so element (y, x) lines up with point (y, x)
+        shift = (size + 1) // 2 - (size - 1)
+        full = np.roll(full, (shift, shift), axis=(-2, -1))
+        
+        return full[..., :height, :width]
+
+    def applyGaussian(self, dartboard, point, max_bytes=64*1024**2):
         """Applies the Gaussian kernel to the point on the dartboard and returns
-           the result.
+           the result. If given an (N, 2) array of points, the kernel is applied
+           to every point and N results are returned. Any part of the kernel 
+           off the board array counts as zeros.
 
         Args:
             dartboard (2D int array): Same dimensions as the dartboard image
                                       to represent the dartboard. Each element 
                                       holds the board value found on a dartboard 
                                       at that location.
-            point (Tuple (int, int)): The point on the dartboard to apply the
-                                      Gaussian kernel at.
+            point (Tuple (int, int) or (N, 2) int array): The point (or points)
+                                      on the dartboard to apply the Gaussian 
+                                      kernel at.
+            max_bytes (int, optional): Memory limit on the windows gathered at
+                                       once when given an array of points.
+                                       Defaults to 64MB.
 
         Returns:
             float: the value returned from applying the Gaussian kernel to the
-                   point on the dartboard.
+                   point on the dartboard. For an array of points, a 1D float 
+                   array holding the value for each point.
         """
         if (self.gaussian is int):
             print("Set gaussian")
             return
         
-        # If gaussian even length, take top left of the central four as mid point
-        y_start = int(point[0] - len(self.gaussian)/2)
-        x_start = int(point[1] - len(self.gaussian[0])/2)
+        if np.ndim(point) == 2:
+            return self.applyGaussianPoints(dartboard, point, max_bytes)
+        
+        # A batch of one, so a kernel running off the board array is zero 
+        # padded the same way as every other path
+        return self.applyGaussianPoints(dartboard, [point])[0]
+    
+    def applyGaussianPoints(self, dartboard, points, max_bytes=64*1024**2):
+        """Applies the Gaussian kernel to an array of points on the dartboard.
+           Windows are read from a strided view of the dartboard and gathered
+           (copied) a chunk of points at a time, with chunks sized so the 
+           windows gathered at once stay under max_bytes. If any window runs 
+           off the board, only the area covered by the windows is copied into
+           a zero padded array.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                      to represent the dartboard. Each element 
+                                      holds the board value found on a dartboard 
+                                      at that location.
+            points ((N, 2) int array): The points (y, x) on the dartboard to 
+                                       apply the Gaussian kernel at.
+            max_bytes (int, optional): Memory limit on the windows gathered at
+                                       once. Defaults to 64MB.
+
+        Returns:
+            1D float array: the expected value at each point.
+        """
+        points = np.asarray(points, dtype=int).reshape(-1, 2)
+        size = len(self.gaussian)
+        
+        # Top left corner of each window, matching applyGaussian
+        starts = points - (size + 1) // 2
+        
+        # Cut out the area covered by the windows, zero padded where it runs
+        # off the board array
+        if len(starts):
+            (top, left), (bottom, right) = starts.min(axis=0), starts.max(axis=0) + size
+            if top < 0 or left < 0 or bottom > dartboard.shape[0] or right > dartboard.shape[1]:
+                covered = np.zeros((bottom - top, right - left), dtype=dartboard.dtype)
+                y0, x0 = max(top, 0), max(left, 0)
+                y1, x1 = min(bottom, dartboard.shape[0]), min(right, dartboard.shape[1])
+                if y0 < y1 and x0 < x1:
+                    covered[y0 - top:y1 - top, x0 - left:x1 - left] = dartboard[y0:y1, x0:x1]
+                dartboard = covered
+            else:
+                dartboard = dartboard[top:bottom, left:right]
+            starts = starts - (top, left)
+        
+        windows = np.lib.stride_tricks.sliding_window_view(dartboard, (size, size))
+        
+        values = np.empty(len(points))
+        chunk = max(1, max_bytes // (size * size * dartboard.itemsize))
+        for i in range(0, len(points), chunk):
+            ys, xs = starts[i:i + chunk, 0], starts[i:i + chunk, 1]
+            values[i:i + chunk] = np.tensordot(windows[ys, xs], self.gaussian, axes=2)
+        
+        return values
+    
+    def calcStencilKernels(self, d):
+        """Calculates a stack of kernels, one for each point in the 3x3 stencil
+           d spaces apart. Each is the Gaussian kernel shifted to its stencil
+           offset inside a window of size (K + 2d) x (K + 2d), so a single
+           window of the dartboard can be scored against all nine at once.
+
+        Args:
+            d (int): the distance between points in the stencil.
+
+        Returns:
+            3D float array: (9, K + 2d, K + 2d) stack of shifted kernels in
+                            STENCIL order.
+        """
+        if d not in self.stencil_kernels:
+            size = len(self.gaussian)
+            kernels = np.zeros((len(STENCIL), size + 2*d, size + 2*d))
+            for i, (dy, dx) in enumerate(STENCIL):
+                y, x = d + dy*d, d + dx*d
+                kernels[i, y:y + size, x:x + size] = self.gaussian
+            self.stencil_kernels[d] = kernels
+        return self.stencil_kernels[d]
+    
+    def applyGaussianStencil(self, dartboard, point, d, rows=None):
+        """Applies the Gaussian kernel to the point on the dartboard and the 
+           eight surrounding points d spaces away in one batched evaluation.
+           Gives the same values as calling applyGaussian on each of the points.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                      to represent the dartboard. Each element 
+                                      holds the board value found on a dartboard 
+                                      at that location.
+            point (Tuple (int, int)): The centre point of the stencil.
+            d (int): the distance between points in the stencil.
+            rows (List [int], optional): indices into STENCIL of the points to
+                                         evaluate. Defaults to all nine.
+
+        Returns:
+            1D float array: expected value at each point, in STENCIL order.
+        """
+        kernels = self.calcStencilKernels(d)
+        if rows is not None:
+            kernels = kernels[rows]
+        size = kernels.shape[1]
+        
+        # Same top left corner as applyGaussianPoints, moved out by d (floored,
+        # so windows starting before the board array line up too)
+        y_start = int(point[0]) - (len(self.gaussian) + 1) // 2 - d
+        x_start = int(point[1]) - (len(self.gaussian[0]) + 1) // 2 - d
         
-        # Take slice of dartboard of size of gaussian kernel, around the centre point
-        db = dartboard[y_start:y_start + len(self.gaussian), x_start:x_start + len(self.gaussian)]
-        # Multiply each point in dartboard by its corresponding gaussian value and sum all results
-        # p value gives relative score of how good the current aim point is
-        p = np.sum(db * self.gaussian)
+        if 0 <= y_start and y_start + size <= dartboard.shape[0] and \
+           0 <= x_start and x_start + size <= dartboard.shape[1]:
+            window = dartboard[y_start:y_start + size, x_start:x_start + size]
+        else:
+            # Window runs off the board array, treat outside as zeros
+            window = np.zeros((size, size))
+            y_low, x_low = max(y_start, 0), max(x_start, 0)
+            y_high = min(y_start + size, dartboard.shape[0])
+            x_high = min(x_start + size, dartboard.shape[1])
+            if y_low < y_high and x_low < x_high:
+                window[y_low - y_start:y_high - y_start, x_low - x_start:x_high - x_start] = \
+                    dartboard[y_low:y_high, x_low:x_high]
         
-        return p
\ No newline at end of file
+        return np.tensordot(kernels, window, axes=2)
+
+
+    def applyGaussianDerivatives(self, dartboard, point, order=2):
+        """Applies the analytic circular Gaussian kernel, and its derivative 
+           kernels, centred exactly at a sub-pixel point on the dartboard. This
+           gives the expected value, its gradient and its Hessian with respect 
+           to the aim point, so the maximum can be found without testing 
+           neighbouring points. The kernel is the same circular Gaussian (and 
+           circular mask) as calcCircularGaussian, but centred on the point 
+           rather than ceil(size/2) pixels before it. Only kernels with mu = 0 
+           are supported.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                      to represent the dartboard. Each element 
+                                      holds the board value found on a dartboard 
+                                      at that location.
+            point (Tuple (float, float)): The point (y, x) on the dartboard to 
+                                          apply the kernel at.
+            order (int, optional): 0 for the expected value only, 1 to include
+                                   the gradient and 2 to include the Hessian.
+                                   Defaults to 2.
+
+        Returns:
+            float: the expected value at the point (order 0).
+            Tuple (float, 1D float array, 2D float array): the expected value, 
+                the gradient (d/dy, d/dx) and the 2x2 Hessian (orders 1 and 2, 
+                the Hessian is None for order 1).
+        """
+        shape, sigma, mu, size, _ = self.params
+        if shape != 'circular' or mu != 0:
+            raise ValueError("Derivative kernels need a circular Gaussian with mu = 0")
+        
+        s = pixelSigma(sigma, size)
+        # calcCircularMask keeps points within (size - 1)/2 + 1 of the centre
+        mask_radius = (size - 1) / 2 + 1
+        r = int(np.ceil(mask_radius)) + 1
+        if self.derivative_normaliser is None:
+            # Sum of the unnormalised kernel centred on a pixel
+            t = np.arange(-r, r + 1)
+            r2 = t[:, None]**2 + t[None, :]**2
+            self.derivative_normaliser = np.sum(np.exp(-r2 / (2.0 * s**2)) * (r2 <= mask_radius**2))
+        
+        cy, cx = int(round(point[0])), int(round(point[1]))
+        window = np.zeros((2*r + 1, 2*r + 1))
+        y_low, x_low = max(cy - r, 0), max(cx - r, 0)
+        y_high, x_high = min(cy + r + 1, dartboard.shape[0]), min(cx + r + 1, dartboard.shape[1])
+        if y_low < y_high and x_low < x_high:
+            window[y_low - (cy - r):y_high - (cy - r), x_low - (cx - r):x_high - (cx - r)] = dartboard[y_low:y_high, x_low:x_high]
+        
+        # Offsets of each window pixel from the point
+        vy = (np.arange(cy - r, cy + r + 1) - point[0])[:, None]
+        vx = (np.arange(cx - r, cx + r + 1) - point[1])[None, :]
+        r2 = vy**2 + vx**2
+        weighted = window * np.exp(-r2 / (2.0 * s**2)) * (r2 <= mask_radius**2) / self.derivative_normaliser
+        
+        value = np.sum(weighted)
+        if order == 0:
+            return value
+        
+        gradient = np.array([np.sum(weighted * vy), np.sum(weighted * vx)]) / s**2
+        hessian = None
+        if order >= 2:
+            yy = np.sum(weighted * vy**2) / s**4 - value / s**2
+            xx = np.sum(weighted * vx**2) / s**4 - value / s**2
+            xy = np.sum(weighted * vy * vx) / s**4
+            hessian = np.array([[yy, xy], [xy, xx]])
+        return value, gradient, hessian
+
+
+"""Memoizes the expected value of applying a Gaussian kernel at points on
+   a dartboard, so each (kernel, point) expected value is calculated at most
+   once. Holds one array the size of the dartboard per kernel, with NaN for
+   points not yet calculated. At most max_kernels arrays are kept, the least
+   recently used kernel is dropped when the limit is reached.
+"""
+class ExpectedValueCache():
+    def __init__(self, dartboard, max_kernels=4):
+        self.dartboard = dartboard
+        self.max_kernels = max_kernels
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def kernelValues(self, gaussian):
+        """Returns the array of cached expected values for the kernel, creating 
+           it (and evicting the least recently used kernel) if needed.
+
+        Args:
+            gaussian (Gaussian): Gaussian holding the kernel being applied.
+
+        Returns:
+            2D float array: cached expected values, NaN where not calculated.
+        """
+        key = gaussian.params
+        if key in self.values:
+            self.values.move_to_end(key)
+        else:
+            if len(self.values) >= self.max_kernels:
+                self.values.popitem(last=False)
+            self.values[key] = np.full(self.dartboard.shape, np.nan)
+        return self.values[key]
+    
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+    
+    def stencilValues(self, gaussian, point, d):
+        """Returns the expected values at the point and the eight surrounding 
+           points d spaces away, only calculating the values not yet cached.
+
+        Args:
+            gaussian (Gaussian): Gaussian holding the kernel to apply.
+            point (Tuple (int, int)): The centre point of the stencil.
+            d (int): the distance between points in the stencil.
+
+        Returns:
+            1D float array: expected value at each point, in STENCIL order.
+        """
+        values = self.kernelValues(gaussian)
+        height, width = values.shape
+        
+        result = np.empty(len(STENCIL))
+        missing = []
+        for i, (dy, dx) in enumerate(STENCIL):
+            y, x = point[0] + dy*d, point[1] + dx*d
+            if 0 <= y < height and 0 <= x < width and not np.isnan(values[y][x]):
+                result[i] = values[y][x]
+            else:
+                missing.append(i)
+        self.hits += len(STENCIL) - len(missing)
+        self.misses += len(missing)
+        
+        if missing:
+            result[missing] = gaussian.applyGaussianStencil(self.dartboard, point, d, rows=missing)
+            for i in missing:
+                y, x = point[0] + STENCIL[i][0]*d, point[1] + STENCIL[i][1]*d
+                if 0 <= y < height and 0 <= x < width:
+                    values[y][x] = result[i]
+        return result
+
@@ -1,30 +1,38 @@
 from dartboard import Dartboard
 import numpy as np
 import copy
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-import queue
 import random
-from collections import namedtuple
+from collections import deque, namedtuple
 
 
 """This class contains the functions to convert the dartboard image (H x W x RGBA) 
    found in the dartboard_img folder to a 2D numpy array (H x W) representation 
-   of a dartboard that holds integer dartboard values (up to 60).
-   The array is created based on image pixel colours and positions. Zeros are
-   added to the array at positions in the image where the pixel is outside of the
-   dartboard.
+   of a dartboard that holds the region (e.g. treble 20) at each point, from 
+   which the dartboard values (up to 60) follow.
+   The array is created based on image pixel colours and positions. Positions
+   in the image where the pixel is outside of the dartboard are a miss.
    This class can currently only generate a dartboard array from the specific
    photo dartboard.png image in /dartboard_img. I aim to make a more generalised
    version in future. 
 """
 class GenerateDartboard:
-    def __init__(self, url):
-        self.img = mpimg.imread(url)
-        
-        # Create db object
-        # First two dimensions (no RGB)
-        self.db = Dartboard(self.img.shape[:2])
+    def __init__(self, url=None):
+        """
+        Args:
+            url (string, optional): path of the dartboard image to generate the
+                                    board from. Defaults to None (no image, 
+                                    only for loading saved boards).
+        """
+        self.img = None
+        self.db = None
+        if url is not None:
+            # Only import matplotlib (slow to import) when decoding an image
+            import matplotlib.image as mpimg
+            self.img = mpimg.imread(url)
+            
+            # Create db object
+            # First two dimensions (no RGB)
+            self.db = Dartboard(self.img.shape[:2])
 
         # Red [1. 0. 0. 1.]
         # Green [0. 0.627451 0. 1.]
@@ -60,12 +68,12 @@ class GenerateDartboard:
         self.colours['black'] = self.img[self.db.centre_pt[0] + 50][self.db.centre_pt[1]]
 
     def createBoard(self):
-        """Creates a queue of unique sections of the dartboard using hardcoded 
+        """Creates a list of unique sections of the dartboard using hardcoded 
            points (x, y). Run a flood filling algorithm on each of the points
-           in the queue and insert the dartboard value at that same point in the 
-           dartboard array.
-           Finishes with a 2D dartboard array filled with dartboard values at the 
-           correct locations, with 0s along the wires and outside the board."""
+           in the list and insert the region at that same point in the 
+           dartboard region array.
+           Finishes with a 2D dartboard array filled with regions at the correct
+           locations, with misses along the wires and outside the board."""
         Point = namedtuple('Point', 'point colour board_value')
 
         bullseye = Point(point=(self.db.centre_pt[0], self.db.centre_pt[1]), 
@@ -255,25 +263,24 @@ class GenerateDartboard:
                    Point(point=(self.db.centre_pt[0] + 220, self.db.centre_pt[1] - 380), 
                          colour=self.colours['green'], board_value=32)]
 
-        numbers = one + two + three + four + five + six + seven + eight + nine + \
-            ten + eleven + twelve + thirteen + fourteen + fifteen + sixteen + \
-            seventeen + eighteen + nineteen + twenty
-
-        q = queue.Queue()
-        q.put(bullseye)
-        q.put(outer_bullseye)
-        [q.put(i) for i in numbers]
+        numbers = [one, two, three, four, five, six, seven, eight, nine, ten, 
+                   eleven, twelve, thirteen, fourteen, fifteen, sixteen, 
+                   seventeen, eighteen, nineteen, twenty]
 
-        while not q.empty():
-            p = q.get()
-            self.floodFill(p.point, p.colour, p.board_value)
+        self.quantiseColours()
+        self.floodFill(bullseye.point, bullseye.colour, Dartboard.BULL)
+        self.floodFill(outer_bullseye.point, outer_bullseye.colour, Dartboard.OUTER_BULL)
+        for number in numbers:
+            # Each number's points are its regions from the centre outwards
+            for p, region in zip(number, Dartboard.numberRegions(number[0].board_value)):
+                self.floodFill(p.point, p.colour, region)
 
-        # Save current progress as a wired board (before wires are allocated)
-        self.db.wired_board = copy.deepcopy(self.db.board)
+        # Save current progress as the wired regions (before wires are allocated)
+        self.db.wired_regions = copy.deepcopy(self.db.regions)
 
-    def floodFillRecursion(self, point, colour, board_value):
+    def floodFillRecursion(self, point, colour, region):
         """Recursively takes a point checks whether the point on the image is 
-           the target colour "to fill". If so, the board value is inserted into 
+           the target colour "to fill". If so, the region is inserted into 
            the identical location in the dartboard. If not, no action is taken.
            It then applys this algorithm to all neighbouring points.
 
@@ -283,25 +290,43 @@ class GenerateDartboard:
             colour (Array [float, float, float, float]): RBGA colour value of 
                                                          the area you want to 
                                                          flood
-            board_value (int): the board value to add to the dartboard at the 
-                               corresponding place (e.g. 50 for the bullseye)
+            region (int): the region ID to add to the dartboard at the 
+                          corresponding place (e.g. Dartboard.BULL for the bullseye)
         """
         # Return if this point on image is not the target colour
         # OR if this position on dartboard has already been filled
-        if not (self.img[point[0]][point[1]] == colour).all() or self.db.board[point[0]][point[1]] == board_value:
+        if not (self.img[point[0]][point[1]] == colour).all() or self.db.regions[point[0]][point[1]] == region:
             return
         else:
-            self.db.board[point[0]][point[1]] = board_value
-            self.floodFill((point[0] + 1, point[1]), colour, board_value)
-            self.floodFill((point[0], point[1] + 1), colour, board_value)
-            self.floodFill((point[0] - 1, point[1]), colour, board_value)
-            self.floodFill((point[0], point[1] - 1), colour, board_value)
-
-    def floodFill(self, point, colour, board_value):
+            self.db.regions[point[0]][point[1]] = region
+            self.db.clearBoards()
+            self.floodFill((point[0] + 1, point[1]), colour, region)
+            self.floodFill((point[0], point[1] + 1), colour, region)
+            self.floodFill((point[0] - 1, point[1]), colour, region)
+            self.floodFill((point[0], point[1] - 1), colour, region)
+
+    def quantiseColours(self):
+        """Replaces each pixel colour in the image with an index into a palette 
+           of the unique colours in the image, so colours can be compared as 
+           single integers instead of RGBA arrays."""
+        pixels = np.ascontiguousarray(self.img.reshape(-1, self.img.shape[-1]))
+        # Number each pixel by its distinct values in each channel in turn, 
+        # 1D unique is much faster than unique over rows
+        colour_index = np.zeros(len(pixels), dtype=np.int64)
+        for channel in pixels.T:
+            _, channel_index = np.unique(channel, return_inverse=True)
+            colour_index = colour_index * (channel_index.max() + 1) + channel_index
+            _, first, colour_index = np.unique(colour_index, return_index=True, return_inverse=True)
+        self.palette = pixels[first]
+        self.colour_index = colour_index.reshape(self.img.shape[:2])
+
+    def floodFill(self, point, colour, region):
         """Takes a point checks whether the point on the image is the target colour 
-           "to fill". If so, the board value is inserted into the identical
-           location in the dartboard. This points neighbours is added to a queue
-           to repeat the process on them. Finished once the queue is empty.
+           "to fill". If so, the region is inserted into the identical
+           location in the dartboard, along with every connected point of the 
+           same colour. Uses a breadth first search over the quantised colour 
+           index image with a visited bitmap, so each pixel is checked a 
+           constant number of times.
 
         Args:
             point (Tuple (int, int)): point (x, y) on the dartboard to apply the 
@@ -309,33 +334,40 @@ class GenerateDartboard:
             colour (1D float array (length 4)): RBGA colour value of 
                                                          the area you want to 
                                                          flood
-            board_value (int): the board value to add to the dartboard at the 
-                               corresponding place (e.g. 50 for the bullseye)
+            region (int): the region ID to add to the dartboard at the 
+                          corresponding place (e.g. Dartboard.BULL for the bullseye)
         """
-        # Return if this point on image is not the target colour
-        # OR if this position on dartboard has already been filled
-        if not (self.img[point[0]][point[1]] == colour).all() or self.db.board[point[0]][point[1]] == board_value:
+        if not hasattr(self, 'colour_index'):
+            self.quantiseColours()
+        height, width = self.colour_index.shape
+        
+        target = np.flatnonzero((self.palette == colour).all(axis=1))
+        if len(target) == 0:
             return
-        else:
-            # Add the board value to input point
-            self.db.board[point[0]][point[1]] = board_value
-            
-            # Create a queue to hold points that its neighbours need to be checked
-            q = queue.Queue()
-            q.put(point)
-            while not q.empty():
-                # Take point from the queue, add neighbouring points around current
-                # point to the queue IF they have the target colour and have not 
-                # yet been filled in the dartboard
-                n = q.get()
-                for pt in [(n[0] + 1, n[1]), (n[0], n[1] + 1), (n[0] - 1, n[1]), (n[0], n[1] - 1)]:
-                    # If this point in the image contains target colour
-                    # AND this point in the dartboard has not yet been filled
-                    # AND this point is not already in the queue
-                    if (self.img[pt[0]][pt[1]] == colour).all() and self.db.board[pt[0]][pt[1]] != board_value and (pt[0], pt[1]) not in q.queue:
-                        self.db.board[pt[0]][pt[1]] = board_value
-                        # Add point to the queue to check neighbours
-                        q.put((pt[0], pt[1]))
+        # Points that can be filled: target colour and not yet in this region
+        fillable = ((self.colour_index == target[0]) & (self.db.regions != region)).ravel()
+        
+        start = point[0] * width + point[1]
+        if not fillable[start]:
+            return
+        
+        fillable = bytearray(fillable.tobytes())
+        fillable[start] = 0
+        filled = [start]
+        q = deque(filled)
+        while q:
+            n = q.popleft()
+            x = n % width
+            # Neighbours below, right, above and left (if inside the image)
+            for pt, inside in ((n + width, n + width < height * width), (n + 1, x + 1 < width), 
+                               (n - width, n >= width), (n - 1, x > 0)):
+                if inside and fillable[pt]:
+                    fillable[pt] = 0
+                    filled.append(pt)
+                    q.append(pt)
+        
+        np.put(self.db.regions, filled, region)
+        self.db.clearBoards()
 
     def calculateMask(self):
         """Calculates the 2D array mask containing 1s where the dartboard is 
@@ -349,70 +381,71 @@ class GenerateDartboard:
                 r = i
                 break
 
-        for i in range(self.db.board_mask.shape[0]):
-            for j in range(self.db.board_mask.shape[1]):
-                d = np.sqrt((self.db.centre_pt[0]-i) **2 + (self.db.centre_pt[1]-j)**2)
-                if d > r:
-                    self.db.board_mask[i][j] = False
-
-    def allocateWire(self, point):
-        """Searches through a 2D dartboard array with dartboard values filled in
-           and for each blank zero value on the dartboard (areas containing wire)
-           it searches for the nearest dartboard value to take the value of.
-           Results in a 2D dartboard with all elements within the dartboard radius
-           contining a dartboard value (no zeros). The only zeros in the 2D dartboard
-           array are locations outside the perimeter of the dartboard.
+        self.db.radius = r
+        self.db.calcCircularMask(r)
+
+    def removeWires(self, max_radius=64):
+        """Gives every wire point (a miss inside the perimeter of the dartboard) 
+           the region of the nearest non-wire point on the dartboard, by 
+           Euclidean distance. Offsets within max_radius are tried in order of
+           distance, each one with one array pass over the wire points still 
+           unassigned, so every wire point takes the value of its true nearest
+           neighbour (ties broken by a fixed offset order). That is up to about
+           pi * max_radius**2 offsets (around 12.9k for 64), but the loop stops
+           as soon as every wire point is assigned, which for the dartboard 
+           image is after about 120 offsets (a radius of 6 pixels). Raises a 
+           ValueError if any wire point is left with no non-wire point within
+           max_radius, rather than leave it scoring 0 on the board.
 
         Args:
-            point (Tuple (int, int)): point (x, y) on the 2D dartboard where a 
-                                      wire is located wire and initially containing 
-                                      zero.
+            max_radius (int, optional): furthest distance in pixels to search 
+                                        for a non-wire point. Defaults to 64.
         """
-        # Copy of board to find nearest values for each point
-        r = 0
-        while True:
-            r += 1
-            local = []
-
-            points = [(point[0], point[1] + r), (point[0], point[1] - r),
-                      (point[0] + r, point[1] + r), (point[0] - r, point[1] - r),
-                      (point[0] + r, point[1]), (point[0] - r, point[1]),
-                      (point[0] - r, point[1] + r), (point[0] + r, point[1] - r)]
-
-            for pt in points:
-                if self.db.board_mask[pt[0]][pt[1]]:  # If on the board
-                    if self.db.wired_board[pt[0]][pt[1]] != 0:  # If point not another wire
-                        local.append(self.db.wired_board[pt[0]][pt[1]])  # Take value
-                else:
-                    local.append(0)  # If reach off the board, take zero
-
-            if any(local):
-                self.db.board[point[0]][point[1]] = local[0]
+        height, width = self.db.shape
+        labelled = (self.db.wired_regions != Dartboard.MISS) & self.db.board_mask
+        wire_y, wire_x = np.nonzero((self.db.regions == Dartboard.MISS) & self.db.board_mask)
+        self.db.wired_regions[wire_y, wire_x] = Dartboard.WIRE
+        
+        # Offsets within max_radius, nearest first
+        r = np.arange(-max_radius, max_radius + 1)
+        dy, dx = [o.ravel() for o in np.meshgrid(r, r, indexing='ij')]
+        d2 = dy**2 + dx**2
+        keep = (d2 > 0) & (d2 <= max_radius**2)
+        order = np.lexsort((dx[keep], dy[keep], d2[keep]))
+        offsets = np.stack((dy[keep][order], dx[keep][order]), axis=1)
+        
+        for oy, ox in offsets:
+            if len(wire_y) == 0:
                 break
-
-    def removeWires(self):
-        """Searches through all points in the 2D dartboard array that are within
-           the perimeter of the dartboard. If a point contains a zero, it is 
-           interpreted as a wire and it takes the nearest board value."""
-        cur = 0
-        for i in range(self.db.board.shape[0]):
-            for j in range(self.db.board.shape[1]):
-                if self.db.board[i][j] == 0 and self.db.board_mask[i][j]:
-                    self.allocateWire((i, j))
+            y, x = wire_y + oy, wire_x + ox
+            inside = (y >= 0) & (y < height) & (x >= 0) & (x < width)
+            found = np.zeros(len(wire_y), dtype=bool)
+            found[inside] = labelled[y[inside], x[inside]]
+            self.db.regions[wire_y[found], wire_x[found]] = self.db.wired_regions[y[found], x[found]]
+            wire_y, wire_x = wire_y[~found], wire_x[~found]
+        self.db.clearBoards()
+        if len(wire_y):
+            # These would score 0 inside the board
+            raise ValueError(f"{len(wire_y)} wire points have no non-wire point within "
+                             f"{max_radius} pixels, e.g. {(int(wire_y[0]), int(wire_x[0]))}")
     
     def load(self, filename):
-        """Loads a dartboard numpy array.
+        """Loads a dartboard from a board file (see Dartboard.save) or a 
+           dartboard numpy array (.npy). Both are memory mapped read only.
            Creates and populates dartboard object with loaded array.
 
         Args:
             file (string): name of the file to load
 
         Returns:
-            2D int array: 2D numpy dartboard array
+            Dartboard: the loaded dartboard object
         """
-        board = np.load(filename)
-        self.db = Dartboard(self.img.shape[:2])  # Create fresh object
-        self.db.board = board
+        if filename.endswith('.npy'):
+            board = np.load(filename, mmap_mode='r')
+            self.db = Dartboard(board.shape)  # Create fresh object
+            self.db.board = board
+        else:
+            self.db = Dartboard.open(filename)
         
         return self.db  # Return dartboard object
 
@@ -425,5 +458,5 @@ class GenerateDartboard:
         #self.printBoardSection((535,1024), 55)
         #self.printBoardSection((176,535), 55)
         #self.printBoardSection((1024,535), 55)
-        np.save('dartboard.npy', self.db.board)
+        self.db.save('dartboard.board')
         return self.db  # Return dartboard object 
\ No newline at end of file
@@ -0,0 +1,137 @@
+from dartboard import Dartboard
+import numpy as np
+
+
+"""This class builds a 2D numpy array (H x W) representation of a dartboard
+   directly from the regulation dartboard geometry, rather than from a photo.
+   Each pixel is placed in polar coordinates around the centre of the board and
+   given the region of the ring and segment it falls in, so a board can be
+   built at any resolution in a few array operations.
+   Points outside the double ring are a miss.
+"""
+class GeneratePolarDartboard:
+    # Regulation radii in mm, measured from the centre of the board to the 
+    # middle of the wire
+    BULL_RADIUS = 6.35
+    OUTER_BULL_RADIUS = 15.9
+    TREBLE_INNER_RADIUS = 99
+    TREBLE_OUTER_RADIUS = 107
+    DOUBLE_INNER_RADIUS = 162
+    DOUBLE_OUTER_RADIUS = 170
+    # Segment numbers clockwise from the top of the board
+    SEGMENTS = [20, 1, 18, 4, 13, 6, 10, 15, 2, 17, 3, 19, 7, 16, 8, 11, 14, 9, 12, 5]
+    
+    def __init__(self, pixels_per_mm=904/338, board_diameter=451, rotation=0, wire_width=0):
+        """
+        Args:
+            pixels_per_mm (float, optional): resolution of the board. Defaults
+                                             to the resolution of the 
+                                             dartboard_img photo (904/338).
+            board_diameter (float, optional): width in mm of the square array,
+                                              the whole board including the 
+                                              number ring. Defaults to 451.
+            rotation (float, optional): clockwise rotation of the segments in
+                                        degrees. Defaults to 0 (20 at the top).
+            wire_width (float, optional): width of the wires in mm. Points on a
+                                          wire are WIRE in the wired regions. 
+                                          Defaults to 0 (no wires).
+        """
+        self.pixels_per_mm = pixels_per_mm
+        self.board_diameter = board_diameter
+        self.rotation = rotation
+        self.wire_width = wire_width
+        
+        size = int(round(board_diameter * pixels_per_mm))
+        self.db = Dartboard((size, size))
+        self.db.pixels_per_mm = pixels_per_mm
+        self.db.radius = self.DOUBLE_OUTER_RADIUS * pixels_per_mm
+    
+    def calcPolar(self):
+        """Calculates the distance (mm) from the centre of every point in the 
+           board array, and its clockwise angle from the top of the board in 
+           units of segments, offset so that segment i (in SEGMENTS order) 
+           covers angles from i to i + 1 (modulo 20).
+
+        Returns:
+            Tuple (2D float array, 2D float array): radius and angle of each point.
+        """
+        height, width = self.db.shape
+        y = ((np.arange(height, dtype=np.float32) - self.db.centre_pt[0]) / self.pixels_per_mm)[:, None]
+        x = ((np.arange(width, dtype=np.float32) - self.db.centre_pt[1]) / self.pixels_per_mm)[None, :]
+        radius = np.sqrt(y*y + x*x)
+        
+        # arctan2 gives (-pi, pi], shift by whole turns so the angle is always 
+        # positive (which lets the integer part be taken by truncation)
+        angle = np.arctan2(x, -y)
+        angle *= np.float32(20 / (2 * np.pi))
+        angle += np.float32(40.5 - (self.rotation % 360) / 18)
+        return radius, angle
+    
+    def generate(self):
+        """Builds the board regions and wired regions, from which the board 
+           values, wired board and board mask follow.
+
+        Returns:
+            Dartboard: the generated dartboard object.
+        """
+        radius, angle = self.calcPolar()
+        radii = np.array([self.BULL_RADIUS, self.OUTER_BULL_RADIUS, self.TREBLE_INNER_RADIUS, 
+                          self.TREBLE_OUTER_RADIUS, self.DOUBLE_INNER_RADIUS, self.DOUBLE_OUTER_RADIUS], dtype=np.float32)
+        
+        # Ring of each point, 0 (bull) to 6 (off the board), and segment index
+        ring = np.searchsorted(radii, radius, side='right').astype(np.uint8)
+        segment = angle.astype(np.uint8)
+        
+        # Region of each (ring, segment) pair, with the segments repeated so 
+        # the segment index does not need reducing modulo 20
+        numbers = np.array(self.SEGMENTS * 3, dtype=np.uint8) - 1
+        regions = np.stack([np.full(60, Dartboard.BULL), np.full(60, Dartboard.OUTER_BULL), 
+                            Dartboard.INNER_SINGLE + numbers, Dartboard.TREBLE + numbers, 
+                            Dartboard.OUTER_SINGLE + numbers, Dartboard.DOUBLE + numbers, 
+                            np.full(60, Dartboard.MISS)]).astype(np.uint8)
+        
+        self.db.regions = regions.ravel()[ring * np.uint16(60) + segment]
+        self.db.wired_regions = self.db.regions.copy()
+        if self.wire_width > 0:
+            self.db.wired_regions[self.calcWires(radius, angle, ring, radii)] = Dartboard.WIRE
+        
+        return self.db
+    
+    def calcWires(self, radius, angle, ring, radii):
+        """Calculates which points lie on a wire: within half the wire width of
+           a ring, or of a segment divider between the outer bull and the 
+           double ring.
+
+        Args:
+            radius (2D float array): distance of each point from the centre (mm).
+            angle (2D float array): angle of each point, from calcPolar.
+            ring (2D int array): index of the ring each point is in.
+            radii (1D float array): radius of each ring.
+
+        Returns:
+            2D bool array: True on the wires.
+        """
+        half = self.wire_width / 2
+        
+        # Distance to the nearest ring, which is one of the two edges of the 
+        # ring the point is in
+        inner = np.concatenate(([-np.inf], radii)).astype(np.float32)[ring]
+        outer = np.concatenate((radii, [np.inf])).astype(np.float32)[ring]
+        np.subtract(radius, inner, out=inner)
+        np.subtract(outer, radius, out=outer)
+        np.minimum(inner, outer, out=inner)
+        wires = inner < half
+        
+        # Distance to the nearest segment divider, dividers are at whole 
+        # numbers of segments. Segments are narrow enough that the arc length
+        # is within 0.5% of the perpendicular distance
+        from_divider = angle - angle.astype(np.uint8)
+        np.subtract(1, from_divider, out=outer)
+        np.minimum(from_divider, outer, out=from_divider)
+        from_divider *= radius
+        from_divider *= np.float32(2 * np.pi / 20)
+        dividers = from_divider < half
+        dividers &= ring > 1
+        dividers &= radius < self.DOUBLE_OUTER_RADIUS + half
+        wires |= dividers
+        return wires
@@ -0,0 +1,137 @@
+from dartboard import Dartboard
+import numpy as np
+
+
+"""Calculates the probability of hitting each region of a dartboard (e.g.
+   treble 20, the bull or a miss) when aiming at each point, for a Gaussian
+   kernel describing the spread of throws. Each region's indicator mask is
+   convolved with the kernel by FFT over a window around the region, in batches
+   of regions sized to a memory limit. The result is a (regions x H x W) tensor
+   indexed by region ID, so the expected value of any value table is a dot 
+   product over the regions.
+"""
+class HitProbabilities():
+    # Regions a dart can land in, region IDs 0 (miss) to BULL
+    NUM_REGIONS = Dartboard.BULL + 1
+
+    def __init__(self, dartboard, max_bytes=256*1024**2):
+        """
+        Args:
+            dartboard (Dartboard): the dartboard, with a region map.
+            max_bytes (int, optional): Memory limit on the FFT arrays of each
+                                       batch of regions. Defaults to 256MB.
+        """
+        if dartboard.regions is None:
+            raise ValueError("Hit probabilities need a dartboard with a region map")
+        self.dartboard = dartboard
+        self.max_bytes = max_bytes
+        
+        # Bounding box (y0, y1, x0, x1) of each region, each region's mask is
+        # zero outside its box
+        ys, xs = np.nonzero(dartboard.regions)
+        ids = dartboard.regions[ys, xs]
+        self.bounds = {}
+        for region in np.unique(ids):
+            inside = ids == region
+            self.bounds[region] = (ys[inside].min(), ys[inside].max() + 1, xs[inside].min(), xs[inside].max() + 1)
+    
+    def calcBatches(self, size, stride):
+        """Splits the regions into batches to convolve together. Each region is
+           convolved over a window around its bounding box grown by the kernel 
+           size (only aim points in the window can hit the region), with every
+           window in a batch the same size. Regions are sorted by window size 
+           so each batch holds similar sized windows.
+
+        Args:
+            size (int): size of the kernel.
+            stride (int): spacing in pixels of the aim points.
+
+        Returns:
+            List [Tuple (List [int], List [Tuple (int, int)], Tuple (int, int))]:
+                the region IDs, top left corner of each window (on the stride 
+                grid) and window shape of each batch.
+        """
+        windows = {}
+        for region, (y0, y1, x0, x1) in self.bounds.items():
+            top, left = (y0 - size) // stride * stride, (x0 - size) // stride * stride
+            windows[region] = (top, left, y1 + size - top, x1 + size - left)
+        order = sorted(windows, key=lambda r: windows[r][2] * windows[r][3], reverse=True)
+        
+        batches = []
+        for region in order:
+            top, left, h, w = windows[region]
+            if batches:
+                ids, corners, (bh, bw) = batches[-1]
+                shape = (max(bh, h), max(bw, w))
+                # Spectra, products and real results of the batch, in float64
+                fft_shape = (shape[0] + size, shape[1] + size)
+                if (len(ids) + 1) * fft_shape[0] * fft_shape[1] * 8 * 4 <= self.max_bytes:
+                    ids.append(region)
+                    corners.append((top, left))
+                    batches[-1] = (ids, corners, shape)
+                    continue
+            batches.append(([region], [(top, left)], (h, w)))
+        return batches
+    
+    def calcProbabilities(self, gaussian, stride=1):
+        """Calculates the probability of hitting each region when aiming at 
+           every stride-th point of the dartboard. Element [r, i, j] is the 
+           probability of hitting region ID r when aiming at point 
+           (i * stride, j * stride). Region MISS holds the probability of 
+           missing the board.
+
+        Args:
+            gaussian (Gaussian): Gaussian holding the kernel to apply.
+            stride (int, optional): spacing in pixels of the aim points. 
+                                    Defaults to 1 (every point).
+
+        Returns:
+            3D float32 array: hit probabilities, shape (NUM_REGIONS, 
+                              ceil(H / stride), ceil(W / stride)).
+        """
+        height, width = self.dartboard.shape
+        size = len(gaussian.gaussian)
+        probabilities = np.zeros((self.NUM_REGIONS, -(-height // stride), -(-width // stride)), dtype=np.float32)
+        
+        # Pad the regions so every window can be cut out of them, windows may 
+        # be bigger than their region needs so pad the end by the largest
+        batches = self.calcBatches(size, stride)
+        pad = size + stride
+        end = pad + max(max(shape) for _, _, shape in batches)
+        regions = np.pad(self.dartboard.regions, (pad, end))
+        
+        for ids, corners, (h, w) in batches:
+            masks = np.stack([regions[top + pad:top + pad + h, left + pad:left + pad + w] == region 
+                              for region, (top, left) in zip(ids, corners)]).astype(np.float32)
+            hits = gaussian.calcExpectedValues(masks, fft_shape=gaussian.fftShape((h, w)))
+            
+            for region, (top, left), hit in zip(ids, corners, hits):
+                # Part of the window on the board, windows start on the stride grid
+                y0, x0 = max(top, 0), max(left, 0)
+                y1, x1 = min(top + h, height), min(left + w, width)
+                probabilities[region, y0 // stride:-(-y1 // stride), x0 // stride:-(-x1 // stride)] = \
+                    hit[y0 - top:y1 - top:stride, x0 - left:x1 - left:stride]
+        
+        # Remove FFT round off below zero, then anything not on the board is a miss
+        np.maximum(probabilities, 0, out=probabilities)
+        probabilities[Dartboard.MISS] = np.maximum(1 - probabilities[1:].sum(axis=0), 0)
+        return probabilities
+    
+    def expectedValues(self, probabilities, values=None):
+        """Calculates the expected value of aiming at each point from the hit
+           probabilities.
+
+        Args:
+            probabilities (3D float array): hit probabilities from
+                                            calcProbabilities.
+            values (1D float array, optional): value of each region ID.
+                                               Defaults to the dartboard's value
+                                               table.
+
+        Returns:
+            2D float array: expected value of aiming at each point.
+        """
+        if values is None:
+            values = self.dartboard.values
+        values = np.asarray(values, dtype=np.float32)[:self.NUM_REGIONS]
+        return np.tensordot(values, probabilities, axes=1)
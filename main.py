@@ -1,7 +1,11 @@
 import numpy as np
+import os
+import itertools
 from collections import namedtuple
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
 from generate_dartboard import GenerateDartboard
-from gaussian import Gaussian
+from gaussian import Gaussian, ExpectedValueCache, STENCIL, fastLength, pixelSigma, kernelCentre, gaussianCorrelate
 
 
 class FinalPoint(namedtuple('FinalPoint', ['point', 'point_value', 'expected_value', 'surrounding_values'])):
@@ -11,8 +15,84 @@ class FinalPoint(namedtuple('FinalPoint', ['point', 'point_value', 'expected_val
         return f"Final Point: (x={self.point[0]}, y={self.point[1]}), point value={self.point_value}, expected value={round(self.expected_value, 2)}, surrounding values {list(map(lambda x : round(x, 2), self.surrounding_values))}"
 
 
+def shareArray(array):
+    """Copies an array into a new block of shared memory.
+
+    Args:
+        array (numpy array): the array to share.
+
+    Returns:
+        Tuple (SharedMemory, Tuple): the shared memory block (to close and unlink
+                                     when finished) and the (name, shape, dtype)
+                                     needed to attach to it from another process.
+    """
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attachArray(spec):
+    """Attaches to an array created by shareArray without copying it.
+
+    Args:
+        spec (Tuple): the (name, shape, dtype) returned by shareArray.
+
+    Returns:
+        Tuple (SharedMemory, numpy array): the shared memory block (which must 
+                                           be kept open while the array is used)
+                                           and the array.
+    """
+    name, shape, dtype = spec
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+# Dartboard and kernel attached by each worker process of runParallel
+_worker = {}
+
+
+def _initDescentWorker(board_spec, kernel_spec, kernel_params):
+    board_shm, board = attachArray(board_spec)
+    kernel_shm, kernel = attachArray(kernel_spec)
+    gaussian = Gaussian()
+    gaussian.gaussian = kernel
+    gaussian.params = kernel_params
+    _worker.update(shms=(board_shm, kernel_shm), dartboard=board, gaussian=gaussian)
+
+
+def _descentWorker(task):
+    loops, seed, d, merge_basins = task
+    dartboard, gaussian = _worker['dartboard'], _worker['gaussian']
+    
+    # Each task gets its own cache and RNG stream so results only depend on 
+    # the seed and the number of tasks
+    cache = ExpectedValueCache(dartboard)
+    rng = np.random.default_rng(seed)
+    starts = [(int(y), int(x)) for y, x in rng.integers(200, 1000, size=(loops, 2))]
+    
+    def stencilValues(point, d):
+        return cache.stencilValues(gaussian, point, d)
+    
+    final_point, path, counts = GradientDescent().searchMaxima(dartboard, starts, stencilValues, d, merge_basins=merge_basins)
+    return final_point, path, counts['merged'], cache.hits, cache.misses
+
+
+def _initSweepWorker(board_spec, spectrum_spec, fft_shape, d):
+    board_shm, board = attachArray(board_spec)
+    spectrum_shm, spectrum = attachArray(spectrum_spec)
+    _worker.update(shms=(board_shm, spectrum_shm), dartboard=board, spectrum=spectrum, fft_shape=fft_shape, d=d)
+
+
+def _sweepWorker(kernel_size):
+    gaussian = Gaussian()
+    gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=kernel_size)
+    expected_values = gaussian.calcExpectedValues(_worker['dartboard'], board_spectrum=_worker['spectrum'], fft_shape=_worker['fft_shape'])
+    return kernel_size, GradientDescent().maximumOfMap(_worker['dartboard'], expected_values, _worker['d'])
+
+
 class GradientDescent:
-    def run(self, dartboard, kernel_size, loops, d=1, display="default", print_kernel=False, debug=False):
+    def run(self, dartboard, kernel_size, loops, d=1, display="default", print_kernel=False, debug=False, use_fft=False, cache=None, merge_basins=True, adaptive=False, starts="random", patience=None):
         """Takes a dartboard to search, the size of the kernel (K x K) to use and
         the number of loops to repeat the search. The algorithm selects a random 
         point on the dartboard. The gaussian distribution kernel is applied to 
@@ -30,9 +110,36 @@ class GradientDescent:
                             to apply during the algorithm.
             loops (int): The number of times to repeat the entire gradient descent process
                         and find the local maximum of a point. The more loops,
-                        the higher the accuracy.
+                        the higher the accuracy. With patience, this is the 
+                        maximum number of loops, and may be None to run until
+                        patience stops the search.
             d (int): the distance away from a point to apply the kernel and 
                     test the values of surrounding points 
+            use_fft (bool, optional): If True, the full expected value map is 
+                    calculated once with an FFT convolution and the descent 
+                    reads each expected value from the map. Defaults to False.
+            cache (ExpectedValueCache, optional): Cache of expected values to 
+                    share between runs on the same dartboard, must be built 
+                    on this dartboard. If not given, a new cache is shared 
+                    across all loops of this run. 
+            merge_basins (bool, optional): If True, each point visited is 
+                    mapped to the local maximum its descent reached, and a 
+                    later descent that steps onto a visited point stops and 
+                    takes the same local maximum. Defaults to True.
+            adaptive (bool, optional): If True, d is only the starting step. 
+                    The step doubles after each move that improves the 
+                    expected value and halves at each apparent local maximum,
+                    until a local maximum is found with a step of 1. Basins 
+                    are not merged, as the descent from a point also depends 
+                    on the step size. Defaults to False.
+            starts (str, optional): "random" for uniformly random starting 
+                    points in a square around the board, or "halton" for a 
+                    low discrepancy sequence of points on the board. Defaults 
+                    to "random".
+            patience (int, optional): stop once this many descents in a row
+                    (including merged descents and descents that reach a 
+                    local maximum already found) have not improved on the best
+                    found. Defaults to None (always run every loop).
 
         Returns:
             Named tuple: (point, board_value, expected_value) 
@@ -54,79 +161,525 @@ class GradientDescent:
         if print_kernel:
             gaussian.printGaussian()
         
+        if use_fft:
+            expected_values = gaussian.calcExpectedValues(dartboard)
+            def stencilValues(point, d):
+                values = np.zeros(len(STENCIL))
+                for i, (dy, dx) in enumerate(STENCIL):
+                    y, x = point[0] + dy*d, point[1] + dx*d
+                    if 0 <= y < expected_values.shape[0] and 0 <= x < expected_values.shape[1]:
+                        values[i] = expected_values[y][x]
+                return values
+        else:
+            if cache is None:
+                cache = ExpectedValueCache(dartboard)
+            elif cache.dartboard is not dartboard:
+                # The cache only holds values for the board it was built on
+                raise ValueError("cache was built for a different dartboard")
+            def stencilValues(point, d):
+                return cache.stencilValues(gaussian, point, d)
+        
+        if patience is not None and patience < 1:
+            raise ValueError(f"patience must be at least 1, not {patience}")
+        if loops is None and patience is None:
+            # Both start generators are endless, only patience stops the search
+            raise ValueError("loops can only be None when patience is given")
+        if starts == "halton":
+            start_points = self.haltonStarts(dartboard)
+        else:
+            # Chose random starting points inside dartboard
+            start_points = ((np.random.randint(200, 1000), np.random.randint(200, 1000)) for _ in itertools.count())
+        start_points = itertools.islice(start_points, loops)
+        final_point, final_gradient_descent_path, counts = self.searchMaxima(dartboard, start_points, stencilValues, d, merge_basins=merge_basins, adaptive=adaptive, patience=patience, debug=debug)
+        
+        print("-"*40, "\n")
+        print("GLOBAL MAXIMA FOUND:", final_point, "\nPATH TAKEN:", final_gradient_descent_path, "\n")
+        print(f"Descents: {counts['descents']}, steps: {counts['steps']}, stencil evaluations: {counts['evaluations']} ({counts['evaluations'] / max(counts['descents'], 1):.1f} per descent)")
+        if merge_basins and not adaptive:
+            print(f"Merged descents: {counts['merged']} of {counts['descents']}")
+        if not use_fft:
+            print(cache, "\n")
+        
+        self.displayResult(final_point, kernel_size, final_gradient_descent_path, display)
+
+        return final_point
+
+    def runParallel(self, dartboard, kernel_size, loops, d=1, workers=None, seed=None, display="default", merge_basins=True):
+        """Runs the same search as run, with the loops split between a pool of
+        worker processes. The dartboard and kernel are placed in shared memory 
+        once rather than copied to every task. Each worker gets its own RNG 
+        stream spawned from the seed, so the result is reproducible for a given 
+        seed and number of workers.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            kernel_size (int): Size of the square kernel (kernel_size X kernel_size)
+                            to apply during the algorithm.
+            loops (int): The total number of gradient descents across all workers.
+            d (int): the distance away from a point to apply the kernel and 
+                    test the values of surrounding points 
+            workers (int, optional): number of worker processes. Defaults to 
+                    the number of CPUs.
+            seed (int, optional): seed for the RNG streams. Defaults to None 
+                    (not reproducible).
+
+        Returns:
+            Named tuple: (point, board_value, expected_value, surrounding_values) 
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        
+        gaussian = Gaussian()
+        gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=kernel_size)
+        
+        print(f"Kernel: ({kernel_size}x{kernel_size}), {workers} workers")
+        
+        # Split the loops as evenly as possible, one task per worker
+        seeds = np.random.SeedSequence(seed).spawn(workers)
+        tasks = [(loops // workers + (i < loops % workers), seeds[i], d, merge_basins) for i in range(workers)]
+        
+        board_shm, board_spec = shareArray(np.asarray(dartboard))
+        kernel_shm, kernel_spec = shareArray(gaussian.gaussian)
+        try:
+            with Pool(workers, initializer=_initDescentWorker, initargs=(board_spec, kernel_spec, gaussian.params)) as pool:
+                results = pool.map(_descentWorker, tasks)
+        finally:
+            for shm in (board_shm, kernel_shm):
+                shm.close()
+                shm.unlink()
+        
+        # Reduce in task order, so ties are resolved the same way every run
+        final_point, final_gradient_descent_path = results[0][:2]
+        for result in results[1:]:
+            if result[0].expected_value > final_point.expected_value:
+                final_point, final_gradient_descent_path = result[:2]
+        merged = sum(result[2] for result in results)
+        hits = sum(result[3] for result in results)
+        misses = sum(result[4] for result in results)
+        
+        print("-"*40, "\n")
+        print("GLOBAL MAXIMA FOUND:", final_point, "\nPATH TAKEN:", final_gradient_descent_path, "\n")
+        if merge_basins:
+            print(f"Merged descents: {merged} of {loops}")
+        print(f"Cache: {hits} hits, {misses} misses\n")
+        
+        self.displayResult(final_point, kernel_size, final_gradient_descent_path, display)
+        
+        return final_point
+
+    def runNewton(self, dartboard, kernel_size, loops, tol=0.01, max_steps=100, display="default", debug=False):
+        """Finds the global maximum with true gradient ascent to sub-pixel aim 
+        points. From each random starting point, the gradient and Hessian of 
+        the expected value are calculated with derivative of Gaussian kernels.
+        A Newton step is taken where the expected value is concave, otherwise a
+        step along the gradient, each limited to one standard deviation and 
+        halved until the expected value increases. The descent stops when the 
+        step is shorter than tol pixels. The kernel is centred on the point 
+        during the ascent, the point and path returned are shifted back by 
+        kernelCentre so they match run, runExact and the other searches.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            kernel_size (int): Size of the square kernel (kernel_size X kernel_size)
+                            to apply during the algorithm.
+            loops (int): The number of gradient ascents to run.
+            tol (float, optional): step length in pixels to stop at. Defaults 
+                    to 0.01.
+            max_steps (int, optional): maximum number of steps in one ascent.
+                    Defaults to 100.
+
+        Returns:
+            Named tuple: (point, board_value, expected_value, surrounding_values) 
+                    with point a sub-pixel (y, x) position.
+        """
+        gaussian = Gaussian()
+        gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=kernel_size)
+        s = pixelSigma(0.3, kernel_size)
+        # The other searches centre the kernel at point + centre
+        centre = kernelCentre(kernel_size)
+        
+        print(f"Kernel: ({kernel_size}x{kernel_size})")
+        
+        final_point = FinalPoint(point=(len(dartboard), len(dartboard[1])), point_value=0, expected_value=0, surrounding_values=[])
+        final_path = []
+        evaluations = 0
+        
+        for i in range(loops):
+            point = np.array([np.random.randint(200, 1000), np.random.randint(200, 1000)], dtype=float)
+            path = [tuple(point)]
+            value, gradient, hessian = gaussian.applyGaussianDerivatives(dartboard, point)
+            evaluations += 1
+            
+            for _ in range(max_steps):
+                if np.linalg.eigvalsh(hessian).max() < 0:
+                    # Concave, Newton step to the maximum of the quadratic
+                    step = -np.linalg.solve(hessian, gradient)
+                elif np.any(gradient):
+                    step = gradient / np.linalg.norm(gradient) * s
+                else:
+                    break
+                if np.linalg.norm(step) > s:
+                    step = step / np.linalg.norm(step) * s
+                
+                # Halve the step until the expected value increases
+                while np.linalg.norm(step) >= tol:
+                    new_value = gaussian.applyGaussianDerivatives(dartboard, point + step, order=0)
+                    evaluations += 1
+                    if new_value > value:
+                        break
+                    step = step / 2
+                if np.linalg.norm(step) < tol:
+                    break
+                
+                point = point + step
+                path.append(tuple(point))
+                value, gradient, hessian = gaussian.applyGaussianDerivatives(dartboard, point)
+                evaluations += 1
+            
+            if value > final_point.expected_value:
+                surrounding_values = [gaussian.applyGaussianDerivatives(dartboard, point + offset, order=0) for offset in STENCIL[1:]]
+                y, x = point - centre
+                final_point = FinalPoint(point=(round(y, 2), round(x, 2)), point_value=dartboard[int(round(y))][int(round(x))], expected_value=value, surrounding_values=surrounding_values)
+                final_path = [(py - centre, px - centre) for py, px in path]
+                if debug:
+                    print("LOOP", i, "--> NEW IMPROVED MAXIMA:", final_point)
+        
+        print("-"*40, "\n")
+        print("GLOBAL MAXIMA FOUND:", final_point, "\nPATH TAKEN:", final_path, "\n")
+        print(f"Kernel evaluations: {evaluations} ({evaluations / loops:.1f} per ascent)\n")
+        
+        self.displayResult(final_point, kernel_size, final_path, display)
+        
+        return final_point
+
+    def runPyramid(self, dartboard, kernel_size, levels=(8, 4, 2), candidates=10, radius=3, d=1, display="default", verify=False):
+        """Finds the global maximum with a coarse to fine search. The dartboard 
+        is averaged down by each factor in levels and the kernel scaled to 
+        match. At the coarsest level the full expected value map is cheap, so 
+        its best local maxima are taken as candidates. At each finer level 
+        (ending at full resolution) each candidate is scaled up and moved to 
+        the best point in a small window around it, repeating until the best 
+        point is inside the window.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            kernel_size (int): Size of the square kernel (kernel_size X kernel_size)
+                            to apply during the algorithm.
+            levels (Tuple of int, optional): downsampling factors, coarsest 
+                    first. Defaults to (8, 4, 2).
+            candidates (int, optional): number of local maxima refined at each
+                    level. Defaults to 10.
+            radius (int, optional): half width of the search window around each 
+                    candidate, in pixels of the current level. Defaults to 3.
+            d (int): the distance away from the maximum to report the expected
+                    values of surrounding points.
+            verify (bool, optional): If True, compare the result with the 
+                    argmax of the full resolution expected value map. 
+                    Defaults to False.
+
+        Returns:
+            Named tuple: (point, board_value, expected_value, surrounding_values) 
+        """
+        dartboard = np.asarray(dartboard)
+        print(f"Kernel: ({kernel_size}x{kernel_size}), levels {levels}")
+        
+        def levelBoard(factor):
+            height, width = (n // factor * factor for n in dartboard.shape)
+            return dartboard[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+        
+        def levelKernel(factor):
+            # Scale so the standard deviation in pixels is divided by factor
+            gaussian = Gaussian()
+            gaussian.calcCircularGaussianSize(max((kernel_size - 1) / factor + 1, 1))
+            return gaussian
+        
+        def refine(board, gaussian, point):
+            # Move to the best point in the window until it is inside the window
+            value = gaussian.applyGaussian(board, [point])[0]
+            while True:
+                ys = np.arange(max(point[0] - radius, 0), min(point[0] + radius + 1, board.shape[0]))
+                xs = np.arange(max(point[1] - radius, 0), min(point[1] + radius + 1, board.shape[1]))
+                points = np.stack(np.meshgrid(ys, xs, indexing='ij'), axis=-1).reshape(-1, 2)
+                values = gaussian.applyGaussian(board, points)
+                best = int(np.argmax(values))
+                if values[best] <= value:
+                    return point, value
+                point, value = (int(points[best][0]), int(points[best][1])), values[best]
+        
+        # Coarsest level, local maxima of the full map
+        factor = levels[0]
+        gaussian = levelKernel(factor)
+        expected_values = gaussian.calcExpectedValues(levelBoard(factor))
+        padded = np.pad(expected_values, 1, constant_values=-np.inf)
+        neighbours = np.lib.stride_tricks.sliding_window_view(padded, (3, 3)).max(axis=(-2, -1))
+        ys, xs = np.nonzero(expected_values >= neighbours)
+        order = np.argsort(-expected_values[ys, xs])[:candidates]
+        points = [(int(ys[i]), int(xs[i])) for i in order]
+        
+        # Refine at each finer level, ending at full resolution
+        for next_factor in list(levels[1:]) + [1]:
+            scale = factor // next_factor
+            board = dartboard if next_factor == 1 else levelBoard(next_factor)
+            gaussian = levelKernel(next_factor)
+            refined = {}
+            for point in points:
+                point = (point[0] * scale + scale // 2, point[1] * scale + scale // 2)
+                point, value = refine(board, gaussian, point)
+                refined[point] = value
+            points = sorted(refined, key=refined.get, reverse=True)[:candidates]
+            factor = next_factor
+        
+        point = points[0]
+        values = gaussian.applyGaussianStencil(dartboard, point, d)
+        final_point = FinalPoint(point=point, point_value=dartboard[point[0]][point[1]], expected_value=refined[point], surrounding_values=list(values[1:]))
+        
+        print("-"*40, "\n")
+        print("GLOBAL MAXIMA FOUND:", final_point, "\n")
+        if verify:
+            exact = gaussian.calcExpectedValues(dartboard)
+            exact_point = np.unravel_index(np.argmax(exact), exact.shape)
+            exact_point = (int(exact_point[0]), int(exact_point[1]))
+            # Points with equal expected value (e.g. on the flat top of treble
+            # 20 for small kernels) are all global maxima
+            if exact_point == point or np.isclose(exact[exact_point], final_point.expected_value, rtol=1e-12):
+                result = 'matches'
+            else:
+                result = f'DOES NOT MATCH (expected value {exact[exact_point]:.4f})'
+            print(f"Full resolution maximum: {exact_point}, {result}\n")
+        
+        self.displayResult(final_point, kernel_size, [point], display)
+        
+        return final_point
+
+    def haltonStarts(self, dartboard):
+        """Generates starting points from a 2D Halton sequence (bases 2 and 3), 
+        keeping only points on the dartboard (non-zero board value). The points 
+        cover the board evenly, without the clumps and gaps of random points.
+
+        Args:
+            dartboard (2D int array): the dartboard.
+
+        Yields:
+            Tuple (int, int): starting points (y, x) on the dartboard.
+        """
+        def radicalInverse(i, base):
+            result, f = 0.0, 1.0 / base
+            while i > 0:
+                result += f * (i % base)
+                i //= base
+                f /= base
+            return result
+        
+        ys, xs = np.nonzero(np.asarray(dartboard))
+        y_low, y_high, x_low, x_high = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        for i in itertools.count(1):
+            point = (int(y_low + radicalInverse(i, 2) * (y_high - y_low)), 
+                     int(x_low + radicalInverse(i, 3) * (x_high - x_low)))
+            if dartboard[point[0]][point[1]] != 0:
+                yield point
+
+    def searchMaxima(self, dartboard, starts, stencilValues, d, merge_basins=True, adaptive=False, max_d=None, patience=None, debug=False):
+        """Runs a gradient descent from each starting point to its local maximum
+        and keeps the highest local maximum found.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            starts (iterable of Tuple (int, int)): the starting point of each descent.
+            stencilValues (function): takes a point and a distance d and 
+                    returns the expected values of the point and its 
+                    surrounding points d spaces away, in STENCIL order.
+            d (int): the distance away from a point to test the values of 
+                    surrounding points (the starting step if adaptive).
+            merge_basins (bool, optional): If True, a descent that steps onto
+                    a point visited by an earlier descent stops and takes the
+                    same local maximum. Ignored if adaptive. Defaults to True.
+            adaptive (bool, optional): If True, double the step after each 
+                    improving move and halve it at each apparent local 
+                    maximum, stopping at a local maximum with a step of 1.
+                    Defaults to False.
+            max_d (int, optional): largest step when adaptive. Defaults to 4*d.
+            patience (int, optional): stop once this many descents in a row
+                    have not improved on the best found. Every descent that 
+                    does not improve counts, so once the best local maximum 
+                    has been found the search always stops. Defaults to None 
+                    (use every starting point).
+
+        Returns:
+            Tuple (FinalPoint, List [Tuple (int, int)], Dict): the highest local
+                    maximum found, the path taken to reach it and counts of 
+                    the 'descents' run, 'steps' taken, stencil 'evaluations' 
+                    and descents 'merged' into an earlier descent.
+        """
+        if adaptive:
+            merge_basins = False
+            if max_d is None:
+                max_d = 4 * d
+        counts = {'descents': 0, 'steps': 0, 'evaluations': 0, 'merged': 0}
+        # How many descents in a row have not improved on the final point
+        unimproved = 0
         # Final = namedtuple('Final', 'point point_value expected_value surrounding_values')
         # Default starting final (expected value at minimum)
         final_point = FinalPoint(point=(len(dartboard), len(dartboard[1])), point_value=0, expected_value=0, surrounding_values=[])
         # Stores the path of points taken to reach the current highest peak we've found so far
         final_gradient_descent_path = []
+        
+        # Index of the local maximum reached from each point visited so far 
+        # (-1 if not visited). The descent from a point always ends at the 
+        # same local maximum, so there is no need to repeat it
+        terminal = np.full(dartboard.shape, -1, dtype=np.int32)
 
         # For each loop, a point is taken and it's local maxima is found
         # If it's local maxima is the largest we've seen so far, we store it in final
-        for i in range(loops):
+        for i, point in enumerate(starts):
             # BEGIN A GRADIENT DESCENT
             
-            # Chose random starting point inside dartboard
-            point = (np.random.randint(200, 1000), np.random.randint(200, 1000))        
             # To build a list of points (x, y) that we have taken during this current 
             # gradient descent
             gradient_descent_path = []
+            step = d
+            counts['descents'] += 1
+            unimproved += 1
             
             # Search for local maximum at this starting point
             while True:
+                
+                on_board = 0 <= point[0] < terminal.shape[0] and 0 <= point[1] < terminal.shape[1]
+                if merge_basins and on_board and terminal[point] != -1:
+                    # Joined the path of an earlier descent. Its local maximum 
+                    # has already been compared against the final point, so the 
+                    # final point and its path cannot change
+                    maximum = terminal[point]
+                    counts['merged'] += 1
+                    break
 
                 # Add 
                 gradient_descent_path.append(point)
                 
-                # Get expected value of this point
-                exp_value = gaussian.applyGaussian(dartboard, point)
-                
-                # Surrouding points (x, y), d spaces away
-                up = (point[0] - d, point[1])
-                down = (point[0] + d, point[1])
-                right = (point[0], point[1] + d)
-                left = (point[0], point[1] - d)
-                up_right = (point[0] - d, point[1] + d)
-                up_left = (point[0] - d, point[1] - d)
-                down_right = (point[0] + d, point[1] + d)
-                down_left = (point[0] + d, point[1] - d)
-                
-                # Expected values for each point
-                up_exp_value = gaussian.applyGaussian(dartboard, up)
-                down_exp_value = gaussian.applyGaussian(dartboard, down)
-                right_exp_value = gaussian.applyGaussian(dartboard, right)
-                left_exp_value = gaussian.applyGaussian(dartboard, left)
-                up_right_exp_value = gaussian.applyGaussian(dartboard, up_right)
-                up_left_exp_value = gaussian.applyGaussian(dartboard, up_left)
-                down_right_exp_value = gaussian.applyGaussian(dartboard, down_right)
-                down_left_exp_value = gaussian.applyGaussian(dartboard, down_left)
+                # Expected values of this point and the surrounding points 
+                # d spaces away, in STENCIL order (centre first)
+                values = stencilValues(point, step)
+                counts['evaluations'] += 1
+                exp_value = values[0]
                 
-                # Mappings of expected value (int) to the point (x, y) that has that expected value
-                value_to_point = {up_exp_value : up, down_exp_value : down, 
-                                right_exp_value : right, left_exp_value : left, 
-                                up_right_exp_value : up_right, up_left_exp_value : up_left, 
-                                down_right_exp_value : down_right, down_left_exp_value : down_left}
-                
-                # Get the maximum expected value our of all the surrouding points
-                max_exp_value = max([up_exp_value, down_exp_value, right_exp_value, left_exp_value, 
-                                up_right_exp_value, up_left_exp_value, down_right_exp_value, down_left_exp_value])
+                # Index of the surrounding point with the maximum expected value
+                # (first in STENCIL order if tied)
+                best = 1 + int(np.argmax(values[1:]))
+                max_exp_value = values[best]
                 
                 if exp_value >= max_exp_value: # If current point is a local maximum (reached a peak)
+                    if adaptive and step > 1:
+                        # Apparent local maximum, look again with a smaller step
+                        # (the point is added to the path again at the top of the loop)
+                        step = max(step // 2, 1)
+                        gradient_descent_path.pop()
+                        continue
+                    maximum = point[0] * terminal.shape[1] + point[1] if on_board else -1
                     if (exp_value > final_point.expected_value):  # If peak we've landed on is higher than any peak we've reached before
                         # Update the final value with the improvement
-                        final_point = FinalPoint(point=point, point_value=dartboard[point[0]][point[1]], expected_value=exp_value, surrounding_values=list(value_to_point.keys()))
+                        final_point = FinalPoint(point=point, point_value=dartboard[point[0]][point[1]], expected_value=exp_value, surrounding_values=list(values[1:]))
                         final_gradient_descent_path = gradient_descent_path
+                        unimproved = 0
                         if debug:
                             print("LOOP", i, "--> NEW IMPROVED MAXIMA:", final_point)
                             print("PATH TAKEN:", final_gradient_descent_path, "\n")
                     break
                 else:
                     # Take the point with the maximum value to use next loop
-                    point = value_to_point[max_exp_value]
+                    point = (point[0] + STENCIL[best][0]*step, point[1] + STENCIL[best][1]*step)
                     gradient_descent_path.append(point)
+                    counts['steps'] += 1
+                    if adaptive:
+                        step = min(step * 2, max_d)
+            
+            if merge_basins:
+                # Record the local maximum reached from each point on this path
+                for p in gradient_descent_path:
+                    if 0 <= p[0] < terminal.shape[0] and 0 <= p[1] < terminal.shape[1]:
+                        terminal[p] = maximum
+            
+            if patience is not None and unimproved >= patience:
+                if debug:
+                    print(f"STOPPING: {patience} descents without improvement")
+                break
+        
+        return final_point, final_gradient_descent_path, counts
+
+    def runExact(self, dartboard, kernel_size, d=1, display="default"):
+        """Finds the exact global maximum by applying the kernel to every point 
+        on the dartboard at once with an FFT convolution and taking the argmax
+        of the expected value map.
+
+        Args:
+            dartboard (2D int array): Same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            kernel_size (int): Size of the square kernel (kernel_size X kernel_size)
+                            to apply during the algorithm.
+            d (int): the distance away from the maximum to report the expected
+                    values of surrounding points.
+
+        Returns:
+            Named tuple: (point, board_value, expected_value, surrounding_values) 
+        """
+        gaussian = Gaussian()
+        gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=kernel_size)
+        
+        print(f"Kernel: ({kernel_size}x{kernel_size})")
+        
+        expected_values = gaussian.calcExpectedValues(dartboard)
+        final_point = self.maximumOfMap(dartboard, expected_values, d)
         
         print("-"*40, "\n")
-        print("GLOBAL MAXIMA FOUND:", final_point, "\nPATH TAKEN:", final_gradient_descent_path, "\n")
+        print("GLOBAL MAXIMA FOUND:", final_point, "\n")
+        
+        self.displayResult(final_point, kernel_size, [final_point.point], display)
         
+        return final_point
+
+    def maximumOfMap(self, dartboard, expected_values, d=1):
+        """Returns the global maximum of an expected value map.
+
+        Args:
+            dartboard (2D int array): the dartboard the map was calculated from.
+            expected_values (2D float array): expected value of aiming at each 
+                                              point on the dartboard.
+            d (int): the distance away from the maximum to report the expected
+                    values of surrounding points.
+
+        Returns:
+            Named tuple: (point, board_value, expected_value, surrounding_values) 
+        """
+        point = np.unravel_index(np.argmax(expected_values), expected_values.shape)
+        point = (int(point[0]), int(point[1]))
+        
+        surrounding_values = []
+        for dy, dx in STENCIL[1:]:
+            y, x = point[0] + dy*d, point[1] + dx*d
+            if 0 <= y < expected_values.shape[0] and 0 <= x < expected_values.shape[1]:
+                surrounding_values.append(expected_values[y][x])
+        
+        return FinalPoint(point=point, point_value=dartboard[point[0]][point[1]], expected_value=expected_values[point], surrounding_values=surrounding_values)
+
+    def displayResult(self, final_point, kernel_size, path, display):
+        """Displays the global maxima found using the chosen display method.
+
+        Args:
+            final_point (FinalPoint): the global maxima found.
+            kernel_size (int): size of the kernel used.
+            path (List [Tuple (int, int)]): the path of points taken to reach
+                                            the global maxima.
+            display (str): "default", "graph", "cmdline", "save" (draw the board
+                           as an image and save it to maxima_<kernel_size>.png
+                           without displaying it) or "none".
+        """
         if display == "default":
             # Display a kernel-sized section of the dartboard where the final point 
             # where the global maxima has been found
@@ -134,21 +687,23 @@ class GradientDescent:
                 print("Displaying to command line...")
                 db.printBoardSection(centre=final_point.point, r=int(kernel_size/2))
             print("Displaying graph...")
-            db.graphBoard(spacing=10, kernel_size=kernel_size, kernel_centres=final_gradient_descent_path)
+            db.graphBoard(spacing=10, kernel_size=kernel_size, kernel_centres=path)
         elif display == "graph":
             # Display the matplotlib graphed dartboard with kernel overlaying the 
             # position of the global maxima
             print("Displaying graph...")
-            db.graphBoard(spacing=10, kernel_size=kernel_size, kernel_centres=final_gradient_descent_path)
+            db.graphBoard(spacing=10, kernel_size=kernel_size, kernel_centres=path)
         elif display == "cmdline":
             print("Displaying to command line...")
             db.printBoardSection(centre=final_point.point, r=int(kernel_size/2))
+        elif display == "save":
+            db.graphBoard(kernel_size=kernel_size, kernel_centres=path, raster=True, 
+                          filename=f"maxima_{kernel_size}.png", show=False)
 
-        return final_point
-
-    def runOverRange(self, dartboard, k_lower, k_higher, loops, step=1, d=1, display="default"):
+    def runOverRange(self, dartboard, k_lower, k_higher, loops, step=1, d=1, display="default", exact=False, workers=None):
         """Applies the gradient descent algorithm for an inclusive range of different
-        kernel sizes.
+        kernel sizes. If exact, the global maximum of each kernel size is found
+        with sweepOverRange instead, and each result is printed as it finishes.
 
         Args:
             dartboard (2D int array): same dimensions as the dartboard image
@@ -157,6 +712,10 @@ class GradientDescent:
             lower (int): the lower bound of the kernel size to use.
             higher (int): the upper bound of the kernel size to use (inclusive).
             step (int, optional): the step size between lower and higher. Defaults to 1.
+            exact (bool, optional): use the parallel FFT sweep instead of 
+                                    gradient descent. Defaults to False.
+            workers (int, optional): number of worker processes for the exact
+                                     sweep. Defaults to the number of CPUs.
 
         Returns:
             Dict (key = int, value = named tuple): kernel_size maps to a named tuple 
@@ -164,22 +723,253 @@ class GradientDescent:
         """
         # Build list of tuples (kernel size, point (x,y), max value) for each kernel size in range
         results = {}
-        for kernel_size in range(k_lower, k_higher+1, step):
-            final = self.run(dartboard, kernel_size, loops, d=d, display=display)
-            results[kernel_size] = final
+        if exact:
+            for kernel_size, final in self.sweepOverRange(dartboard, k_lower, k_higher, step=step, d=d, workers=workers):
+                print(f"Kernel size={kernel_size} --> {final}")
+                results[kernel_size] = final
+            results = dict(sorted(results.items()))
+        else:
+            for kernel_size in range(k_lower, k_higher+1, step):
+                final = self.run(dartboard, kernel_size, loops, d=d, display=display)
+                results[kernel_size] = final
         
         print("\nRESULTS:")
         for kernel_size, result in results.items():
             print(f"Kernel size={kernel_size} --> {result}")
         return results
 
+    def sweepOverRange(self, dartboard, k_lower, k_higher, step=1, d=1, workers=None):
+        """Finds the exact global maximum for an inclusive range of kernel sizes
+        with FFT convolutions spread across a pool of worker processes. The 
+        Fourier transform of the dartboard is calculated once, at a size large 
+        enough for the largest kernel, and shared with every worker. Results 
+        are yielded as each kernel size finishes, not in kernel size order.
 
-if __name__ == "__main__":
-    board = GenerateDartboard('dartboard_img/dartboard.png')
+        Args:
+            dartboard (2D int array): same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            k_lower (int): the lower bound of the kernel size to use.
+            k_higher (int): the upper bound of the kernel size to use (inclusive).
+            step (int, optional): the step size between lower and higher. Defaults to 1.
+            d (int): the distance away from each maximum to report the expected
+                    values of surrounding points.
+            workers (int, optional): number of worker processes. Defaults to 
+                                     the number of CPUs.
+
+        Yields:
+            Tuple (int, FinalPoint): a kernel size and its global maximum.
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        dartboard = np.asarray(dartboard)
+        
+        fft_shape = tuple(fastLength(n + k_higher) for n in dartboard.shape)
+        spectrum = np.fft.rfft2(dartboard, s=fft_shape)
+        
+        board_shm, board_spec = shareArray(dartboard)
+        spectrum_shm, spectrum_spec = shareArray(spectrum)
+        del spectrum
+        try:
+            with Pool(workers, initializer=_initSweepWorker, initargs=(board_spec, spectrum_spec, fft_shape, d)) as pool:
+                yield from pool.imap_unordered(_sweepWorker, range(k_lower, k_higher+1, step))
+        finally:
+            for shm in (board_shm, spectrum_shm):
+                shm.close()
+                shm.unlink()
 
+
+    def sweepIncremental(self, dartboard, k_lower, k_higher, step=1, d=1, check_every=20):
+        """Finds the global maximum for an inclusive range of kernel sizes by 
+        carrying the expected value map from one kernel size to the next. 
+        Blurring by one Gaussian then another is the same as blurring by a 
+        Gaussian whose variance is the sum of theirs, so the map for the next 
+        size is the current map correlated with a small Gaussian of standard 
+        deviation sqrt(s2**2 - s1**2) (a few pixels for a step of 1, see 
+        gaussianCorrelate), instead of a full size FFT. On a 1200x1200 board
+        each kernel size costs a little over half the direct calculation from
+        a reused board spectrum, checks included.
+        The kernels from calcCircularGaussian are cut off by a circular mask, 
+        so the carried map drifts from the direct calculation. At the second 
+        and last kernel sizes, and every check_every sizes, the direct map is
+        calculated, the largest drift over the board is reported and the 
+        carried map restarts from the direct one. In between, the drift is 
+        assumed to be at most twice the drift per kernel size found at the 
+        last check, and every point within that of the carried maximum is 
+        rescored exactly with applyGaussianPoints, so the maximum reported is
+        the maximum of the direct map. The drift at the rescored points is 
+        reported for every kernel size, and if it is more than assumed the 
+        direct map is used for that size instead.
+
+        Args:
+            dartboard (2D int array): same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            k_lower (int): the lower bound of the kernel size to use.
+            k_higher (int): the upper bound of the kernel size to use (inclusive).
+            step (int, optional): the step size between lower and higher. Defaults to 1.
+            d (int): the distance away from each maximum to report the expected
+                    values of surrounding points.
+            check_every (int, optional): number of kernel sizes between checks
+                    against the direct calculation. Defaults to 20, None to 
+                    only check the second and last kernel sizes.
+
+        Yields:
+            Tuple (int, FinalPoint): a kernel size and its global maximum.
+        """
+        dartboard = np.asarray(dartboard)
+        height, width = dartboard.shape
+        
+        # The maps cover every aim point a kernel of the largest size can 
+        # reach the board from, and are zero beyond
+        margin = (k_higher + 1) // 2 + 1
+        padded = np.pad(dartboard, margin)
+        board = (slice(margin, margin + height), slice(margin, margin + width))
+        gaussian = Gaussian()
+        gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=k_higher)
+        fft_shape = gaussian.fftShape(padded.shape)
+        board_spectrum = np.fft.rfft2(padded, s=fft_shape)
+        
+        kernel_sizes = list(range(k_lower, k_higher+1, step))
+        # Drift per kernel size found at the last check, and kernel sizes 
+        # carried since
+        drift_rate = 0
+        carried = 0
+        for i, kernel_size in enumerate(kernel_sizes):
+            gaussian.calcCircularGaussian(sigma=0.3, mu=0, size=kernel_size)
+            if i == 0:
+                expected_values = gaussian.calcExpectedValues(padded, board_spectrum, fft_shape)
+                yield kernel_size, self.maximumOfMap(dartboard, expected_values[board], d)
+                continue
+            
+            previous = kernel_sizes[i-1]
+            increment = np.sqrt(pixelSigma(0.3, kernel_size)**2 - pixelSigma(0.3, previous)**2)
+            expected_values = gaussianCorrelate(expected_values, increment, shift=kernelCentre(kernel_size) - kernelCentre(previous))
+            carried += 1
+            
+            check = i == 1 or i == len(kernel_sizes) - 1 or (check_every is not None and i % check_every == 0)
+            if not check:
+                # Rescore every point that could be the maximum of the direct map
+                bound = 2 * drift_rate * carried
+                on_board = expected_values[board]
+                points = np.argwhere(on_board >= on_board.max() - 2*bound)
+                # Rescoring a point costs a full kernel, past a few multiplies
+                # per map element the direct map is cheaper
+                check = len(points) * kernel_size**2 > 8 * expected_values.size
+                if check:
+                    print(f"Kernel size={kernel_size} has {len(points)} points near the maximum, using the direct map")
+            if not check:
+                exact = gaussian.applyGaussianPoints(dartboard, points)
+                drift = np.abs(exact - on_board[points[:, 0], points[:, 1]]).max()
+                print(f"Kernel size={kernel_size} difference from direct at {len(points)} points near the maximum: max {drift:.2e}")
+                if drift <= bound:
+                    y, x = (int(c) for c in points[np.argmax(exact)])
+                    around = np.array([(y + dy*d, x + dx*d) for dy, dx in STENCIL[1:]])
+                    inside = ((around >= 0) & (around < (height, width))).all(axis=1)
+                    surrounding_values = list(gaussian.applyGaussianPoints(dartboard, around[inside]))
+                    yield kernel_size, FinalPoint(point=(y, x), point_value=dartboard[y][x], expected_value=exact.max(), surrounding_values=surrounding_values)
+                    continue
+                print(f"Kernel size={kernel_size} drifted more than {bound:.2e}, using the direct map")
+            
+            direct = gaussian.calcExpectedValues(padded, board_spectrum, fft_shape)
+            drift = np.abs(expected_values - direct)[board]
+            moved = self.maximumOfMap(dartboard, expected_values[board]).point != self.maximumOfMap(dartboard, direct[board]).point
+            print(f"Kernel size={kernel_size} difference from direct after {carried} sizes: max {drift.max():.2e}, mean {drift.mean():.2e}{', maximum moved' if moved else ''}")
+            drift_rate = drift.max() / carried
+            carried = 0
+            expected_values = direct
+            yield kernel_size, self.maximumOfMap(dartboard, expected_values[board], d)
+
+
+    def regionMask(self, dartboard, region, margin=0):
+        """Returns a boolean mask of a target region of the dartboard, grown by 
+        margin pixels in every direction.
+
+        Args:
+            dartboard (2D int array): the dartboard.
+            region (int or 2D bool array): a board value that only appears in the
+                    region (e.g. 60 for treble 20, 57 for treble 19) or a mask.
+            margin (int, optional): pixels to grow the region by. Defaults to 0.
+
+        Returns:
+            2D bool array: True inside the region.
+        """
+        if np.ndim(region) == 0:
+            mask = np.asarray(dartboard) == region
+        else:
+            mask = np.asarray(region, dtype=bool)
+        if margin > 0:
+            # Square dilation, one axis at a time
+            for axis in (0, 1):
+                padded = np.pad(mask, [(margin, margin) if a == axis else (0, 0) for a in (0, 1)])
+                mask = np.lib.stride_tricks.sliding_window_view(padded, 2*margin + 1, axis=axis).max(axis=-1)
+        return mask
+
+    def findCriticalKernelSize(self, dartboard, region_a, region_b, k_lower, k_higher, margin=20, fractional=False, tol=0.01):
+        """Finds the kernel size at which the best point to aim for moves from 
+        one target region to another (e.g. from treble 20 to treble 19) by 
+        bisection. At each probe, the expected value map is calculated with an 
+        FFT and the best expected value in each region is compared. This needs
+        O(log range) maps instead of a full search at every kernel size.
+
+        Args:
+            dartboard (2D int array): same dimensions as the dartboard image
+                                    to represent the dartboard. Each element holds
+                                    the board value found on a dartboard at that location.
+            region_a (int or 2D bool array): the region that is best at k_lower,
+                    as a board value unique to the region or a mask.
+            region_b (int or 2D bool array): the region that is best at k_higher.
+            k_lower (float): kernel size where region_a is better.
+            k_higher (float): kernel size where region_b is better.
+            margin (int, optional): pixels to grow each region by, so maxima 
+                    just outside the region count. Defaults to 20.
+            fractional (bool, optional): If True, bisect over fractional kernel 
+                    sizes down to tol, otherwise over whole kernel sizes. 
+                    Defaults to False.
+            tol (float, optional): width of the final bracket when fractional.
+                    Defaults to 0.01.
+
+        Returns:
+            Tuple (float, float): the largest kernel size found where region_a 
+                    is better and the smallest where region_b is better.
+        """
+        dartboard = np.asarray(dartboard)
+        mask_a = self.regionMask(dartboard, region_a, margin)
+        mask_b = self.regionMask(dartboard, region_b, margin)
+        
+        fft_shape = tuple(fastLength(n + int(np.ceil(k_higher))) for n in dartboard.shape)
+        spectrum = np.fft.rfft2(dartboard, s=fft_shape)
+        
+        def difference(kernel_size):
+            gaussian = Gaussian()
+            gaussian.calcCircularGaussianSize(kernel_size)
+            expected_values = gaussian.calcExpectedValues(dartboard, board_spectrum=spectrum, fft_shape=fft_shape)
+            best_a = expected_values[mask_a].max()
+            best_b = expected_values[mask_b].max()
+            print(f"Kernel size={kernel_size} (sigma={pixelSigma(0.3, kernel_size):.2f}px) --> A={best_a:.4f}, B={best_b:.4f}")
+            return best_a - best_b
+        
+        if difference(k_lower) <= 0:
+            raise ValueError(f"Region A is not better than region B at kernel size {k_lower}")
+        if difference(k_higher) > 0:
+            raise ValueError(f"Region B is not better than region A at kernel size {k_higher}")
+        
+        lower, higher = k_lower, k_higher
+        while (higher - lower > tol) if fractional else (higher - lower > 1):
+            mid = (lower + higher) / 2 if fractional else (lower + higher) // 2
+            if difference(mid) > 0:
+                lower = mid
+            else:
+                higher = mid
+        
+        print(f"\nCritical kernel size between {lower} and {higher}")
+        return lower, higher
+
+
+if __name__ == "__main__":
     # Get board
-    #db = board.generate()
-    db = board.load('dartboard.npy')
+    #db = GenerateDartboard('dartboard_img/dartboard.png').generate()
+    db = GenerateDartboard().load('dartboard.board')
 
     algorithm = GradientDescent()
     # Perform Gradient Descent